@@ -15,44 +15,313 @@ IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied.
 """
 
+import atexit
+import hmac
 import json
 import logging
 import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
 
 import requests
-from flask import Flask, jsonify, render_template, request
+from flask import (Blueprint, Flask, Response, current_app, g, jsonify,
+                   render_template, request, send_file, stream_with_context)
 
+import dedup
+import metrics
+import models
+from batch import parse_item
 from bot import ChatBot
+from cards import card_cache
 from conversion import Converter
+from exporting import find_table
+from workers import WorkerPool
 
-# Create flask instance
-app = Flask(__name__)
 port = int(os.environ.get("PORT", 5000))
 
-# Create an instance of the chat bot
-bot = ChatBot()
+routes = Blueprint("meercat", __name__)
 
 
-@app.route('/')
+def create_app(warm=True):
+    # Nothing here calls out to Webex, DialogFlow or the database, the
+    # clients are created the first time they're used. Set warm to False to
+    # leave loading the catalog and cards until the first request too.
+    app = Flask(__name__)
+
+    # Create an instance of the chat bot
+    app.bot = ChatBot()
+
+    # Optionally hand webhooks off to a pool of workers and reply to Webex straight away
+    app.webhook_pool = None
+    if os.getenv("ASYNC_WEBHOOKS", "false").lower() == "true":
+        app.webhook_pool = start_webhook_pool()
+
+    # Webex redelivers webhooks when we're slow to answer, remember the ones
+    # already handled so a retry doesn't run them again. Set
+    # WEBHOOK_DEDUP_PATH to share them between worker processes.
+    app.webhook_dedup = dedup.create_store(
+        os.getenv("WEBHOOK_DEDUP_PATH"),
+        ttl=int(os.getenv("WEBHOOK_DEDUP_TTL", 600)),
+        maxsize=int(os.getenv("WEBHOOK_DEDUP_SIZE", 10000)))
+
+    # Largest bill of materials /convert/batch will take in one request
+    app.config["BATCH_MAX_ITEMS"] = int(os.getenv("BATCH_MAX_ITEMS", 1000))
+
+    # Time every statement the database runs, once it's connected
+    models.on_engine_created(metrics.instrument_engine)
+    register_gauges(app)
+
+    app.before_request(start_request_timer)
+    app.after_request(record_request_duration)
+    app.teardown_appcontext(remove_db_session)
+    app.register_blueprint(routes)
+
+    if warm:
+        # Load the catalog and render the cards while the first requests
+        # can already be served
+        threading.Thread(target=warm_bot, args=(app.bot, ),
+                         daemon=True).start()
+
+    return app
+
+
+def warm_bot(bot):
+    try:
+        bot.warm()
+    except Exception:
+        # Everything it loads is loaded again when it's first used
+        logging.exception("Failed to warm the bot up")
+    finally:
+        models.Session.remove()
+
+
+def start_webhook_pool():
+    webhook_pool = WorkerPool(workers=int(os.getenv("WEBHOOK_WORKERS", 4)),
+                              max_queue=int(
+                                  os.getenv("WEBHOOK_QUEUE_DEPTH", 100)))
+    webhook_pool.start()
+
+    drain_timeout = int(os.getenv("WEBHOOK_DRAIN_TIMEOUT", 30))
+    atexit.register(webhook_pool.shutdown, drain_timeout)
+
+    # Drain the queue when the container is stopped as well
+    def handle_sigterm(signum, frame):
+        webhook_pool.shutdown(drain_timeout)
+        sys.exit(0)
+
+    try:
+        signal.signal(signal.SIGTERM, handle_sigterm)
+    except ValueError:
+        # Signals can only be registered from the main thread
+        pass
+
+    return webhook_pool
+
+
+def register_gauges(app):
+    bot = app.bot
+
+    def cache_stats():
+        caches = {
+            "intent": bot.converter.intent_cache,
+            "people": bot.directory.people,
+            "emails": bot.directory.emails,
+            "usernames": bot.directory.usernames,
+            "rooms": bot.directory.rooms,
+        }
+        stats = {}
+        for cache_name, cache in caches.items():
+            for stat, value in cache.stats().items():
+                stats[(cache_name, stat)] = value
+        for stat, value in card_cache.stats().items():
+            stats[("cards", stat)] = value
+        return stats
+
+    metrics.registry.gauge("meercat_cache", "Cache sizes and hit counts",
+                           cache_stats, ["cache", "stat"])
+    metrics.registry.gauge("meercat_db_pool", "Database connection pool usage",
+                           models.pool_stats, ["stat"])
+    metrics.registry.gauge("meercat_admission",
+                           "Rate limiting and database concurrency",
+                           bot.admission.stats, ["limiter", "stat"])
+    metrics.registry.gauge("meercat_webhook_dedup",
+                           "Webhooks remembered and redeliveries skipped",
+                           app.webhook_dedup.stats, ["stat"])
+    if app.webhook_pool:
+        metrics.registry.gauge("meercat_webhook_queue",
+                               "Background webhook worker usage",
+                               app.webhook_pool.stats, ["stat"])
+
+
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+def record_request_duration(response):
+    started = g.get("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.request_duration.observe(time.perf_counter() - started,
+                                         route, request.method,
+                                         str(response.status_code))
+    return response
+
+
+def remove_db_session(exception=None):
+    # Every request shares one database session, close it once it's done
+    models.Session.remove()
+
+
+def run_webhook(app, handler, json_data, key=None):
+    # Worker threads need their own app context for jsonify and friends
+    with app.app_context():
+        try:
+            handler(json_data)
+        except Exception:
+            # Let a retry of this webhook through
+            if key:
+                app.webhook_dedup.release(key)
+            raise
+
+
+def is_webhook(json_data):
+    # Webex sends an object with the ID of what changed under data
+    if not isinstance(json_data, dict):
+        return False
+    data = json_data.get("data", None)
+    return isinstance(data, dict) and bool(data.get("id", None))
+
+
+def enqueue_webhook(handler, json_data, key=None):
+    app = current_app._get_current_object()
+    if not app.webhook_pool.submit(run_webhook, app, handler, json_data, key):
+        # The queue is full, Webex will retry the webhook later
+        if key:
+            app.webhook_dedup.release(key)
+        return jsonify({"message": "Busy"}), 503
+
+    return jsonify({"message": "OK"})
+
+
+def handle_webhook(handler, json_data):
+    # Only handle payloads that look like a Webex webhook
+    if not is_webhook(json_data):
+        return jsonify({"message": "Invalid webhook payload"}), 400
+
+    # Checked before anything else so a redelivery costs no calls out
+    key = dedup.webhook_key(json_data)
+    if key and not current_app.webhook_dedup.claim(key):
+        return jsonify({"message": "Already received"})
+
+    if current_app.webhook_pool:
+        return enqueue_webhook(handler, json_data, key)
+    try:
+        return handler(json_data)
+    except Exception:
+        if key:
+            current_app.webhook_dedup.release(key)
+        raise
+
+
+@routes.route('/')
 def index():
     gif = "https://66.media.tumblr.com/0a14eda38c31356d1e164009ef1edf2f/tumblr_mjpnd23P7x1qhbw13o1_400.gifv"
     return render_template('index.html', gif_url=gif)
 
 
-@app.route('/compare', methods=["POST"])
+@routes.route('/compare', methods=["POST"])
 def compare():
-    return bot.compare(request.json)
+    return current_app.bot.compare(request.json)
 
 
-@app.route('/events', methods=['POST'])
+@routes.route('/events', methods=['POST'])
 def message_received():
     # Get the POST data sent from Webex Teams
-    return bot.receive_message(request.json)
+    return handle_webhook(current_app.bot.receive_message, request.json)
 
 
-@app.route('/actions', methods=['POST'])
+@routes.route('/actions', methods=['POST'])
 def attachment_action_received():
-    return bot.execute_action(request.json)
+    return handle_webhook(current_app.bot.execute_action, request.json)
+
+
+def is_authorised():
+    # Scripted access needs API_TOKEN passed as a bearer token
+    token = os.getenv("API_TOKEN")
+    if not token:
+        return False
+    return hmac.compare_digest(request.headers.get("Authorization", ""),
+                               f"Bearer {token}")
+
+
+@routes.route('/export/<table_name>.csv', methods=['GET'])
+def export_table(table_name):
+    if not is_authorised():
+        return jsonify({"message": "Unauthorised"}), 401
+
+    table_name, model = find_table(table_name)
+    if not model:
+        return jsonify({"message": "Unknown table"}), 404
+
+    # Stream the rows straight out as they are read from the database
+    return Response(stream_with_context(current_app.bot.exporter.iter_csv(model)),
+                    mimetype="text/csv",
+                    headers={
+                        "Content-Disposition":
+                        f"attachment; filename=meercat_{table_name}.csv"
+                    })
+
+
+@routes.route('/export.zip', methods=['GET'])
+def export_all():
+    if not is_authorised():
+        return jsonify({"message": "Unauthorised"}), 401
+
+    directory = tempfile.mkdtemp()
+    path = current_app.bot.exporter.export(directory)
+
+    response = send_file(path,
+                         mimetype="application/zip",
+                         as_attachment=True,
+                         attachment_filename=os.path.basename(path))
+    response.call_on_close(lambda: shutil.rmtree(directory, True))
+    return response
+
+
+@routes.route('/convert/batch', methods=['POST'])
+def convert_batch():
+    if not is_authorised():
+        return jsonify({"message": "Unauthorised"}), 401
+
+    json_data = request.get_json(silent=True) or {}
+    items = json_data.get("items", None)
+    if not isinstance(items, list):
+        return jsonify({"message": "Expected a list of items"}), 400
+    batch_max_items = current_app.config["BATCH_MAX_ITEMS"]
+    if len(items) > batch_max_items:
+        return jsonify(
+            {"message": f"At most {batch_max_items} items can be converted at once"}), 413
+
+    try:
+        items = [parse_item(item) for item in items]
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    return jsonify(current_app.bot.batch_converter.convert(items))
+
+
+@routes.route('/metrics', methods=['GET'])
+def serve_metrics():
+    # Open to scrapers unless API_TOKEN is set, then it needs the token too
+    if os.getenv("API_TOKEN") and not is_authorised():
+        return jsonify({"message": "Unauthorised"}), 401
+
+    return Response(metrics.registry.render(),
+                    mimetype="text/plain; version=0.0.4")
 
 
 # run Flask app
@@ -65,4 +334,12 @@ if __name__ == "__main__":
         print("DIALOGFLOW_PROJECT_ID not found in environment variables")
         exit()
 
+    app = create_app()
+    # Check the token up front rather than on the first message
+    try:
+        app.bot.me
+    except RuntimeError as e:
+        print(f"{e}...exiting")
+        exit()
+
     app.run("0.0.0.0", port=port)
@@ -0,0 +1,162 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import catalog
+import metrics
+from equivalence import equivalence_engine
+
+# What happened to each line of a batch
+MATCHED = "matched"
+AMBIGUOUS = "ambiguous"
+MODULAR_NEEDS_MODULE = "modular-needs-module"
+UNMAPPED = "unmapped"
+NOT_FOUND = "not-found"
+
+STATUSES = (MATCHED, AMBIGUOUS, MODULAR_NEEDS_MODULE, UNMAPPED, NOT_FOUND)
+
+
+def parse_line(line):
+    # "C9300-48P-A C9300-NM-8X" => ("C9300-48P-A", "C9300-NM-8X")
+    words = line.split()
+    if not words:
+        return None, None
+    return words[0], " ".join(words[1:]) or None
+
+
+def parse_item(item):
+    # Items sent to /convert/batch are a line of text or an object
+    if isinstance(item, str):
+        return parse_line(item)
+    if isinstance(item, dict):
+        model = item.get("model", None)
+        network_module = item.get("network_module", None)
+        for value in (model, network_module):
+            if value is not None and not isinstance(value, str):
+                raise ValueError(f"{value!r} in {item!r} is not text")
+        return model, network_module
+    raise ValueError(f"{item!r} is not a model or an object")
+
+
+def parse_text(text):
+    # One SKU per line or separated by commas, as sent to the /convert command
+    lines = text.replace(",", "\n").split("\n")
+    return [parse_line(line) for line in lines if line.strip()]
+
+
+class BatchConverter():
+    # Converts a whole bill of materials in one pass over the in-memory
+    # catalog, rather than one chat round trip per SKU
+    def __init__(self, switch_index=None, mapping_graph=None):
+        super().__init__()
+        self.switch_index = switch_index or catalog.switch_index
+        self.mapping_graph = mapping_graph or catalog.mapping_graph
+
+    def split_model(self, model, network_module):
+        # Allows the combined ID of a modular switch, e.g. C9300-48P-A-C9300-NM-8X,
+        # and network modules without their vendor prefix, e.g. MOD-2X40G
+        found = self.switch_index.lookup_model(model)
+        if found:
+            model = found[0]
+            network_module = network_module or found[1]
+        if network_module:
+            network_module = self.switch_index.lookup_network_module(
+                network_module) or network_module
+        return model, network_module
+
+    def resolve(self, model, network_module):
+        # Mirrors Converter.find_equivalent_switch for a single SKU
+        switches = self.switch_index.find(model=model,
+                                          network_module=network_module)
+        if not switches:
+            return {"status": NOT_FOUND}
+        if len(switches) > 1:
+            # Adding a network module only helps if every match is modular
+            if not network_module and all(switch.modular
+                                          for switch in switches):
+                return {
+                    "status": MODULAR_NEEDS_MODULE,
+                    "candidates": [switch.id for switch in switches]
+                }
+            return {
+                "status": AMBIGUOUS,
+                "candidates": [switch.id for switch in switches]
+            }
+
+        switch = switches[0]
+        mapping_ids = self.mapping_graph.neighbours(switch.id) or \
+            self.mapping_graph.neighbours(switch.id, fuzzy_match=True)
+        if not mapping_ids:
+            return {
+                "status": UNMAPPED,
+                "switch": switch.id,
+                "nearest": [{
+                    "id": equivalent.switch.id,
+                    "confidence": round(equivalent.confidence, 2),
+                    "deficits": equivalent.deficits
+                } for equivalent in equivalence_engine.nearest(switch)]
+            }
+        return {
+            "status": MATCHED,
+            "switch": switch.id,
+            "mapping_ids": mapping_ids
+        }
+
+    @metrics.span()
+    def convert(self, items, resolved=None):
+        # items are (model, network module) pairs. Returns a result per
+        # item, in the same order, plus a count of each status. Passing
+        # the same resolved dict to each call of a chunked batch means a
+        # SKU is only looked up once across the whole batch.
+        if resolved is None:
+            resolved = {}
+        keys = []
+        for model, network_module in items:
+            if not model:
+                keys.append(None)
+                continue
+            # Repeated SKUs are only looked up once
+            key = (model.lower(), (network_module or "").lower())
+            if key not in resolved:
+                resolved[key] = self.resolve(
+                    *self.split_model(model, network_module))
+            keys.append(key)
+
+        # Every mapped ID in the batch is resolved together
+        mapping_ids = []
+        for result in resolved.values():
+            mapping_ids.extend(result.get("mapping_ids", []))
+        matches = self.switch_index.group_by_ids(mapping_ids)
+        for result in resolved.values():
+            if "mapping_ids" in result:
+                # Fuzzy mappings can resolve to several switches
+                result["equivalents"] = list(
+                    dict.fromkeys(switch.id
+                                  for id in result.pop("mapping_ids")
+                                  for switch in matches[id]))
+
+        results = []
+        summary = {status: 0 for status in STATUSES}
+        for (model, network_module), key in zip(items, keys):
+            result = {"model": model, "network_module": network_module}
+            if key is None:
+                result["status"] = NOT_FOUND
+            else:
+                result.update(resolved[key])
+            summary[result["status"]] += 1
+            results.append(result)
+
+        return {"summary": summary, "results": results}
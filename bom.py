@@ -0,0 +1,219 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import csv
+import os
+import time
+import zipfile
+from itertools import chain, islice
+
+import xlrd
+from urllib3.exceptions import HTTPError
+
+import utils
+from batch import STATUSES, BatchConverter
+
+CSV_EXTENSIONS = (".csv", )
+EXCEL_EXTENSIONS = (".xlsx", ".xlsm", ".xls")
+
+# What a file that isn't really a CSV or spreadsheet fails with, or a
+# download that breaks off part way through
+READ_ERRORS = (csv.Error, UnicodeDecodeError, xlrd.XLRDError,
+               zipfile.BadZipFile, OSError, HTTPError)
+
+# Header names a BOM might use for each column, checked in lower case
+SKU_HEADERS = ("sku", "model", "pid", "product", "product id", "part number",
+               "part", "item")
+NETWORK_MODULE_HEADERS = ("network module", "network_module", "module", "nm")
+QUANTITY_HEADERS = ("quantity", "qty", "count")
+
+OUTPUT_HEADER = [
+    "Line", "Original SKU", "Network Module", "Quantity", "Equivalent SKU",
+    "Status", "Notes"
+]
+
+
+def is_bom(filename):
+    return filename.lower().endswith(CSV_EXTENSIONS + EXCEL_EXTENSIONS)
+
+
+def cell_text(cell):
+    # Numbers come out of xlrd as floats, e.g. 48.0
+    if cell.ctype == xlrd.XL_CELL_NUMBER and cell.value == int(cell.value):
+        return str(int(cell.value))
+    return str(cell.value).strip()
+
+
+def iter_excel_rows(path):
+    # Only the first sheet is read, and only once it's needed
+    workbook = xlrd.open_workbook(path, on_demand=True)
+    try:
+        sheet = workbook.sheet_by_index(0)
+        for row in sheet.get_rows():
+            yield [cell_text(cell) for cell in row]
+    finally:
+        workbook.release_resources()
+
+
+def find_column(header, names):
+    for i, name in enumerate(header):
+        if name in names:
+            return i
+    return None
+
+
+def describe_result(result):
+    # The equivalent SKU and notes columns for a converted line
+    status = result["status"]
+    if status == "matched":
+        return " / ".join(result["equivalents"]), ""
+    if status == "unmapped":
+        if not result["nearest"]:
+            return "", "No equivalent found."
+        nearest = result["nearest"][0]
+        notes = f"No direct equivalent, closest by specs ({nearest['confidence']:.0%} match)"
+        if nearest["deficits"]:
+            notes += ", short on " + ", ".join(
+                f"{name} by {amount}"
+                for name, amount in nearest["deficits"].items())
+        return nearest["id"], notes + "."
+    if status == "modular-needs-module":
+        return "", "Modular switch, add one of: " + ", ".join(
+            result["candidates"]) + "."
+    if status == "ambiguous":
+        return "", "More than one model matches: " + ", ".join(
+            result["candidates"]) + "."
+    return "", "Not found in the catalog."
+
+
+class BOMResult():
+    def __init__(self, filename):
+        self.filename = filename
+        self.rows = 0
+        self.summary = {status: 0 for status in STATUSES}
+        self.errors = []
+
+    def __str__(self):
+        if self.errors:
+            return f"**Couldn't convert {self.filename}:** {' '.join(self.errors)}"
+
+        counts = ", ".join(f"{count} {status}"
+                           for status, count in self.summary.items()
+                           if count)
+        return f"**Converted {self.rows} rows of {self.filename}:** {counts or 'nothing to convert'}."
+
+
+class ProgressReporter():
+    # Posts how far a long conversion has got, at most once per interval
+    def __init__(self, send, interval=15):
+        super().__init__()
+        self.send = send
+        self.interval = interval
+        self._last_sent = time.monotonic()
+
+    def update(self, text):
+        now = time.monotonic()
+        if now - self._last_sent >= self.interval:
+            self._last_sent = now
+            self.send(text)
+
+
+class BOMConverter():
+    # Converts a bill of materials file a chunk of rows at a time, writing
+    # the converted rows straight out so memory use doesn't grow with the
+    # size of the file
+    def __init__(self, batch_converter=None, chunk_size=500):
+        super().__init__()
+        self.batch_converter = batch_converter or BatchConverter()
+        self.chunk_size = chunk_size
+
+    def read_rows(self, filename, download, directory):
+        # Returns an iterator over the rows of the file as lists of text
+        if filename.lower().endswith(CSV_EXTENSIONS):
+            return csv.reader(utils.iter_text_lines(download))
+
+        # Spreadsheets are zip files read from the end, so they are
+        # streamed to disk first rather than held in memory
+        path = os.path.join(directory, "bom" + os.path.splitext(filename)[1])
+        with open(path, "wb") as f:
+            for chunk in download.iter_content(65536):
+                f.write(chunk)
+        return iter_excel_rows(path)
+
+    def convert(self, filename, rows, output, progress=None):
+        result = BOMResult(filename)
+        writer = csv.writer(output)
+        writer.writerow(OUTPUT_HEADER)
+
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            result.errors.append("The file is empty.")
+            return result
+
+        # Use the header row to find the columns, or assume the SKU comes
+        # first when there isn't one
+        header = [value.strip().lower() for value in first]
+        sku_column = find_column(header, SKU_HEADERS)
+        module_column = find_column(header, NETWORK_MODULE_HEADERS)
+        quantity_column = find_column(header, QUANTITY_HEADERS)
+        line = 1
+        if sku_column is None:
+            sku_column = 0
+            rows = chain([first], rows)
+            line = 0
+
+        def value(row, column):
+            if column is None or column >= len(row):
+                return ""
+            return row[column].strip()
+
+        # SKUs already looked up, shared by every chunk
+        resolved = {}
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                break
+
+            lines = []
+            items = []
+            for row in chunk:
+                line += 1
+                sku = value(row, sku_column)
+                if not sku:
+                    continue
+                lines.append((line, row))
+                items.append((sku, value(row, module_column) or None))
+
+            batch = self.batch_converter.convert(items, resolved=resolved)
+            for (line_number, row), converted in zip(lines,
+                                                     batch["results"]):
+                equivalent, notes = describe_result(converted)
+                writer.writerow([
+                    line_number, converted["model"],
+                    converted["network_module"] or "",
+                    value(row, quantity_column), equivalent,
+                    converted["status"], notes
+                ])
+            for status, count in batch["summary"].items():
+                result.summary[status] += count
+            result.rows += len(items)
+
+            if progress:
+                progress.update(f"Converted {result.rows} rows of {filename} so far...")
+
+        return result
@@ -18,45 +18,104 @@ or implied.
 import json
 import logging
 import os
+import tempfile
 from pprint import pprint
+from types import GeneratorType
 
+import requests
 from flask import jsonify
-from webexteamssdk import WebexTeamsAPI, Webhook
-from webexteamssdk.exceptions import ApiError
 
+import catalog
+import metrics
 import responses
 import utils
+from batch import BatchConverter, parse_text
+from bom import READ_ERRORS, BOMConverter, ProgressReporter, is_bom
+from cache import Lazy
+from cards import card_cache
 from conversion import Converter
 from editing import Editor
+from exporting import EXPORT_TABLES, Exporter, find_table
+from importing import Importer
+from intents import IntentParser
+from limits import AdmissionControl
+from similarity import similarity_index
+
+
+def create_api():
+    # The Webex client library is slow to import, so it's left until it's
+    # used. Every call made through the API is timed for /metrics.
+    import webexteamssdk
+
+    return metrics.TracedAPI(webexteamssdk.WebexTeamsAPI())
 
 
 class ChatBot():
     def __init__(self):
         super().__init__()
-        self.api = WebexTeamsAPI()
-        self.me = self.api.people.me()
+        # The Webex client and the bot's own details are fetched the first
+        # time they're needed rather than when the app starts
+        self.api = Lazy(create_api)
+        self._me = Lazy(self.find_me)
+        # Shared cache of people and rooms
+        self.directory = utils.WebexDirectory(
+            self.api, ttl=int(os.getenv("WEBEX_DIRECTORY_TTL", 3600)))
 
         # Create instance of the Converter model
         project_id = str(os.getenv('DIALOGFLOW_PROJECT_ID'))
         self.converter = Converter(project_id, "unique")
         self.editor = Editor()
+        self.intent_parser = IntentParser()
+        self.exporter = Exporter()
+        self.importer = Importer()
+        self.batch_converter = BatchConverter()
+        self.bom_converter = BOMConverter(
+            self.batch_converter,
+            chunk_size=int(os.getenv("BOM_CHUNK_SIZE", 500)))
+        self.bom_progress_interval = int(
+            os.getenv("BOM_PROGRESS_INTERVAL", 15))
+        # Rate limits per person and room, and a cap on database work
+        self.admission = AdmissionControl(
+            person_per_minute=int(os.getenv("PERSON_RATE_LIMIT", 20)),
+            person_burst=int(os.getenv("PERSON_RATE_BURST", 10)),
+            room_per_minute=int(os.getenv("ROOM_RATE_LIMIT", 60)),
+            room_burst=int(os.getenv("ROOM_RATE_BURST", 20)),
+            db_concurrency=int(os.getenv("DB_CONCURRENCY", 10)),
+            db_timeout=float(os.getenv("DB_QUEUE_TIMEOUT", 5)))
+
+    @property
+    def me(self):
+        return self._me.get()
+
+    def find_me(self):
         # Check if the token represents a bot
-        me_resp = self.api.people.me()
-        if me_resp.type != 'bot':
-            print(
-                'WEBEX_TEAMS_ACCESS_TOKEN does not belong to a bot...exiting')
-            exit()
-
-    def handle_command(self, person_id, command):
+        me = self.api.people.me()
+        if me.type != 'bot':
+            raise RuntimeError(
+                'WEBEX_TEAMS_ACCESS_TOKEN does not belong to a bot')
+        return me
+
+    def warm(self):
+        # Build the catalog index up front so the first lookup is fast
+        catalog.switch_index.load()
+        catalog.mapping_graph.load()
+        # Render the switch cards up front so conversions only send them
+        if os.getenv("CARD_CACHE_WARM", "true").lower() == "true":
+            card_cache.warm()
+        # So the first message doesn't wait on Webex for the bot's details
+        self._me.get()
+
+    def handle_command(self, person_id, command, room_id=None, files=None):
         # Trim the message to get the command type (e.g "/help something" => "help")
-        command_type = command.strip().split(" ")[0][1:]
+        command_type = command.strip().split()[0][1:]
         try:
-            parameters = command.strip().split(" ", 1)[1]
+            # Split on any whitespace so a command can be followed by lines
+            parameters = command.strip().split(None, 1)[1]
         # Will throw an error if no parameters are passed
         except IndexError:
             parameters = ""
 
-        username = utils.person_id_to_username(self.api, person_id)
+        username = self.directory.get_username(person_id)
 
         # Do some things depending on the command
         if command_type == "help":
@@ -67,20 +126,46 @@ class ChatBot():
         elif command_type == "info":
             switch = self.editor.get_switch_by_id(parameters)
             if switch:
-                return utils.Responses.generate_model_response(switch)
+                return card_cache.get(switch)
             else:
                 return "Sorry, I couldn't find an equivalent switch for that."
+        elif command_type == "convert":
+            # /convert with a spreadsheet attached converts the spreadsheet
+            if files and not parameters:
+                results = self.convert_boms(room_id, files)
+                if results is None:
+                    return "Only CSV and Excel files can be converted."
+                return results
+            batch = self.batch_converter.convert(parse_text(parameters))
+            return utils.Responses.generate_batch_response(batch)
         elif command_type == "list":
+            # A trailing "page N" asks for one page of the list, e.g. "/list switches C9300 page 2"
+            page = None
+            words = parameters.split()
+            if len(words) >= 2 and words[-2].lower() == "page":
+                try:
+                    page = max(int(words[-1]), 1)
+                    parameters = " ".join(words[:-2])
+                except ValueError:
+                    pass
+            list_command = f"/list {parameters}".strip()
+
             if "switch" in parameters or parameters == "":
                 switches = self.editor.list_all_switches(parameters)
-                return utils.Responses.generate_switches_response(switches)
+                if type(switches) == str:
+                    return switches
+                return utils.Responses.generate_switches_response(
+                    switches, page=page, command=list_command)
             elif "map" in parameters:
                 mapping = self.editor.list_all_mapping(parameters)
-                return utils.Responses.generate_mapping_response(mapping)
+                if type(mapping) == str:
+                    return mapping
+                return utils.Responses.generate_mapping_response(
+                    mapping, page=page, command=list_command)
             elif "user" in parameters:
                 users = self.editor.get_approved_users()
                 return utils.Responses.generate_approved_users_response(
-                    self.api, users)
+                    self.api, users, directory=self.directory)
             else:
                 return responses.RESPONSE_NOT_IMPLEMENTED
         elif command_type == "edit":
@@ -119,14 +204,120 @@ class ChatBot():
         elif command_type == "request":
             # Send a request message to all admins
             utils.Responses.generate_user_access_request(
-                self.api, self.editor, person_id, username, parameters)
+                self.api,
+                self.editor,
+                person_id,
+                username,
+                parameters,
+                directory=self.directory)
         elif command_type == "export":
-            return responses.RESPONSE_NOT_IMPLEMENTED
+            # Check if the user is allowed to edit
+            if not self.editor.can_user_edit(username):
+                return responses.RESPONSE_NO_PERMISSION
+            return self.export_database(room_id, parameters)
         elif command_type == "import":
-            return responses.RESPONSE_NOT_IMPLEMENTED
+            # Check if the user is allowed to edit
+            if not self.editor.can_user_edit(username):
+                return responses.RESPONSE_NO_PERMISSION
+            return self.import_database(files)
         else:
             return responses.RESPONSE_COMMAND_NOT_RECOGNISED
 
+    def export_database(self, room_id, parameters):
+        table_name = None
+        if parameters:
+            table_name, model = find_table(parameters)
+            if not table_name:
+                return f"Cannot export {parameters}, please choose from {', '.join(EXPORT_TABLES)}."
+
+        # The export is written to disk so that it can be uploaded as a file
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.exporter.export(directory, table_name)
+            self.api.messages.create(
+                roomId=room_id,
+                markdown="**Here is the current export of the database.**",
+                files=[path])
+
+    def import_database(self, files):
+        if not files:
+            return responses.RESPONSE_IMPORT_NO_FILE
+
+        results = []
+        for url in files:
+            try:
+                filename, content_type, download = utils.open_attachment(
+                    self.api, url)
+            except requests.RequestException as e:
+                results.append(f"**Couldn't read an attachment:** {e}")
+                continue
+            try:
+                if not filename.lower().endswith(".csv"):
+                    results.append(f"Skipped {filename}, only CSV files can be imported.")
+                    continue
+                # The file is parsed as it streams in
+                result = self.importer.import_csv(
+                    utils.iter_text_lines(download))
+                results.append(str(result))
+            except READ_ERRORS as e:
+                results.append(f"**Couldn't read {filename}:** {e}")
+            finally:
+                download.close()
+
+        return results
+
+    def convert_boms(self, room_id, files):
+        # Returns a response for each attachment that looked like a bill of
+        # materials, or None if none of them did
+        results = None
+        for url in files:
+            # Only the headers are fetched to see if it's worth downloading
+            try:
+                filename, content_type = utils.attachment_info(self.api, url)
+            except requests.RequestException as e:
+                results = results or []
+                results.append(f"**Couldn't read an attachment:** {e}")
+                continue
+            if not is_bom(filename):
+                continue
+
+            results = results or []
+            result = self.convert_bom(room_id, url, filename)
+            if result:
+                results.append(result)
+
+        return results
+
+    def convert_bom(self, room_id, url, filename):
+        def send(text):
+            self.api.messages.create(roomId=room_id, markdown=text)
+
+        send(f"Converting {filename}, I'll send it back once it's done.")
+        progress = ProgressReporter(send, interval=self.bom_progress_interval)
+
+        # The converted rows are written to disk as they're worked out
+        with tempfile.TemporaryDirectory() as directory:
+            name = os.path.splitext(os.path.basename(filename))[0]
+            path = os.path.join(directory, f"{name}_converted.csv")
+            try:
+                filename, content_type, download = utils.open_attachment(
+                    self.api, url)
+                try:
+                    rows = self.bom_converter.read_rows(
+                        filename, download, directory)
+                    with open(path, "w", newline="") as output:
+                        result = self.bom_converter.convert(
+                            filename, rows, output, progress=progress)
+                finally:
+                    download.close()
+            except READ_ERRORS as e:
+                return f"**Couldn't read {filename}:** {e}"
+
+            if result.errors:
+                return str(result)
+            self.api.messages.create(roomId=room_id,
+                                     markdown=str(result),
+                                     files=[path])
+
     def compare(self, json_data):
         data = json_data
 
@@ -135,14 +326,21 @@ class ChatBot():
         person_id = session_id[0]
         room_id = session_id[1]
 
+        fields = data["queryResult"]["parameters"]
+        fulfillment_text = self.convert(fields, room_id)
+
+        reply = {"fulfillmentText": fulfillment_text}
+
+        return jsonify(reply)
+
+    def convert(self, fields, room_id, match_data=None):
         # The text to return and send back to the user
-        # This will sometimes be overridden by DialogFlow
         fulfillment_text = ""
 
-        fields = data["queryResult"]["parameters"]
         switch_entity = fields.get("Model", None)
 
-        match_data = self.converter.find_equivalent_switch(fields)
+        if match_data is None:
+            match_data = self.converter.find_equivalent_switch(fields)
         matched_switches = match_data.get("switches", None)
         switch_entity = match_data.get("matched_model", switch_entity)
 
@@ -150,15 +348,22 @@ class ChatBot():
         if not matched_switches:
             # Couldn't find any switch matching the model
             if not match_data["matched"]:
-                fulfillment_text = "Sorry, I couldn't find any switch matching that model number."
+                fulfillment_text = self.suggest_switches(
+                    fields.get("Model", None),
+                    fields.get("Network_Module", None))
             # Found a switch but couldn't find an equivalent
+            elif match_data.get("nearest", None):
+                fulfillment_text = self.describe_nearest(
+                    switch_entity, match_data["nearest"])
             else:
                 fulfillment_text = f"Sorry, I couldn't find an equivalent switch for that."
         # Multiple fixed chassis matches
         elif len(matched_switches) > 1 and not match_data[
                 "modular"] and not match_data["matched"]:
             fulfillment_text = "**I've found multiple matches for that model - please be more specific.**\n\n"
-            for switch in matched_switches:
+            # Closest to what was typed first, as nothing has matched yet
+            for switch in similarity_index.rank(fields.get("Model", None),
+                                                matched_switches):
                 fulfillment_text += f"- {switch.model}\n"
             fulfillment_text = fulfillment_text[:-1]
 
@@ -182,25 +387,75 @@ class ChatBot():
                 self.api.messages.create(roomId=room_id, markdown=message)
             else:
                 for switch in matched_switches:
-                    attachment = utils.Responses.generate_model_response(
-                        switch, original_model=switch_entity)
+                    attachment = card_cache.get(switch,
+                                                original_model=switch_entity)
                     self.api.messages.create(roomId=room_id,
                                              text=str(switch),
                                              attachments=[attachment])
 
-        reply = {"fulfillmentText": fulfillment_text}
-
-        return jsonify(reply)
+        return fulfillment_text
+
+    def suggest_switches(self, model, network_module=None):
+        # Offers the closest models when nothing matched, e.g. for a typo
+        query = model or ""
+        if network_module:
+            query += f"-{network_module}"
+        suggestions = similarity_index.search(query) if query else []
+        if not suggestions:
+            return "Sorry, I couldn't find any switch matching that model number."
+
+        text = f"**Sorry, I couldn't find the {query}. Did you mean:**\n\n"
+        for suggestion, score in suggestions:
+            text += f"- {suggestion}\n"
+        return text[:-1]
+
+    def describe_nearest(self, model, nearest):
+        # Lists the closest switches by specs when there's no mapping
+        text = f"**There's no direct equivalent for the {model}, but these are the closest by their specs:**\n\n"
+        for equivalent in nearest:
+            text += f"- {equivalent.switch.id} ({equivalent.confidence:.0%} match"
+            if equivalent.deficits:
+                shortfalls = ", ".join(
+                    f"{name} by {amount}"
+                    for name, amount in equivalent.deficits.items())
+                text += f", short on {shortfalls}"
+            text += ")\n"
+        text += "\n*To find out more information about any particular switch, type '/info [SWITCH]'*"
+        return text
+
+    def admit(self, person_id, room_id):
+        # False if the person or room is over its rate limit. They're told
+        # so, but only once in a while so the notice can't flood the room.
+        if person_id == self.me.id or self.admission.allow(
+                person_id, room_id):
+            return True
+        if self.admission.should_notify(room_id):
+            self.api.messages.create(
+                roomId=room_id, markdown=responses.RESPONSE_RATE_LIMITED)
+        return False
 
     def execute_action(self, json_data):
+        from webexteamssdk import Webhook
+
         # Create a Webhook object from the JSON data
         webhook_obj = Webhook(json_data)
-        # Get the room details
-        room = self.api.rooms.get(webhook_obj.data.roomId)
+        # The room ID is all we need from the room so don't look it up
+        room_id = webhook_obj.data.roomId
+
+        # Shed the action before doing anything if there's too much coming in
+        if not self.admit(webhook_obj.data.personId, room_id):
+            return "OK"
+
+        with self.admission.db.slot() as admitted:
+            if not admitted:
+                self.api.messages.create(roomId=room_id,
+                                         markdown=responses.RESPONSE_BUSY)
+                return "OK"
+            return self.apply_action(webhook_obj, room_id)
+
+    def apply_action(self, webhook_obj, room_id):
         # Get the message details
         action = self.api.attachment_actions.get(webhook_obj.data.id)
-        # Get the sender's details
-        person = self.api.people.get(action.personId)
 
         # This is a VERY IMPORTANT loop prevention control step.
         # If you respond to all messages...  You will respond to the messages
@@ -218,14 +473,14 @@ class ChatBot():
             inputs = self.editor.sanitise_inputs(action.inputs)
         # Will return a string if something went wrong, otherwise a dict
         if type(inputs) == str:
-            self.api.messages.create(roomId=room.id,
+            self.api.messages.create(roomId=room_id,
                                      markdown=str(f"**{inputs}**"))
         else:
             edit_result = self.editor.edit_switch_by_id(
                 action.inputs["id"], inputs)
             # Same here, if something goes wrong it will be a str
             if type(edit_result) == str:
-                self.api.messages.create(roomId=room.id,
+                self.api.messages.create(roomId=room_id,
                                          markdown=str(f"**{edit_result}**"))
             else:
                 # Everything is OK
@@ -234,22 +489,28 @@ class ChatBot():
                     message = f"Successfully updated {action.inputs['id']}"
                 else:
                     message = f"Successfully added {action.inputs['id']}"
-                self.api.messages.create(roomId=room.id,
+                self.api.messages.create(roomId=room_id,
                                          markdown=str(f"**{message}!**"))
 
         return "OK"
 
     def receive_message(self, json_data):
+        from webexteamssdk import Webhook
+
         # Create a Webhook object from the JSON data
         webhook_obj = Webhook(json_data)
-        # Get the room details
-        room = self.api.rooms.get(webhook_obj.data.roomId)
+        # The room ID is all we need from the room so don't look it up
+        room_id = webhook_obj.data.roomId
+
+        # Shed the message before doing anything if there's too much coming in
+        if not self.admit(webhook_obj.data.personId, room_id):
+            return jsonify({"message": "Rate limited"})
         # Get the message details
         message = self.api.messages.get(webhook_obj.data.id)
-        # Get the sender's details
-        person = self.api.people.get(message.personId)
 
         # if __debug__:
+        #     room = self.directory.get_room(room_id)
+        #     person = self.directory.get_person(message.personId)
         #     print(f"\nNEW MESSAGE IN ROOM '{room.title}'")
         #     print(f"FROM '{person.displayName}'")
         #     print(f"MESSAGE '{message.text}'\n")
@@ -262,11 +523,7 @@ class ChatBot():
             # Message was sent by me (bot); do not respond.
             return "OK"
 
-        if not message.text or message.text == "":
-            print("Empty message.")
-            return "OK"
-
-        message_text = message.text
+        message_text = message.text or ""
 
         # Remove the user tag
         if message_text.lower().startswith("meercat"):
@@ -274,51 +531,79 @@ class ChatBot():
                 part for part in message_text.split(" ")
                 if part.lower() != "meercat"
             ])
+
+        # Spreadsheets posted to the room are converted as a bill of materials
+        if message.files and not message_text.strip().startswith("/"):
+            response_message = self.convert_boms(room_id, message.files)
+            if response_message is not None:
+                self.send_responses(room_id, response_message)
+                return jsonify({"message": "OK"})
+
+        if not message_text.strip():
+            print("Empty message.")
+            return "OK"
+
         # Fix for help command
         if message_text.strip() == "help":
             message_text = "/help"
 
         # User has entered a command
         if message_text.strip()[0] == "/":
-            response_message = self.handle_command(message.personId,
-                                                   message_text)
+            # Commands are what read and write the database
+            with self.admission.db.slot() as admitted:
+                if admitted:
+                    response_message = self.handle_command(
+                        message.personId,
+                        message_text,
+                        room_id=room_id,
+                        files=message.files)
+                else:
+                    response_message = responses.RESPONSE_BUSY
         else:
-            # Create a unique session id as a combo of person and room id
-            # We will also use this in the future to send content back (probably a little hacky)
-            session_id = message.personId + "." + room.id
+            # Plain model numbers can be answered without a DialogFlow round trip
+            fields = self.intent_parser.parse(message_text)
+            match_data = None
+            if fields:
+                match_data = self.converter.find_equivalent_switch(fields)
+
+            if match_data and match_data["matched"]:
+                response_message = self.convert(fields,
+                                                room_id,
+                                                match_data=match_data)
+            else:
+                # Create a unique session id as a combo of person and room id
+                # We will also use this in the future to send content back (probably a little hacky)
+                session_id = message.personId + "." + room_id
+
+                # Call DialogFlow API to parse intent of message
+                response = self.converter.detect_intent(
+                    session_id, message_text, 'en')
+                parameters = response["parameters"]
+
+                # The /compare webhook isn't called for a cached result,
+                # so run the conversion here with the cached parameters
+                if response["cached"] and parameters.get("Model", None):
+                    response_message = self.convert(parameters, room_id)
+                else:
+                    response_message = response["fulfillment_text"]
+
+        self.send_responses(room_id, response_message)
 
-            # Call DialogFlow API to parse intent of message
-            response = self.converter.detect_intent_texts(
-                session_id, message_text, 'en')
-            response_message = response.fulfillment_text
+        response_text = {"message": "OK"}
+        return jsonify(response_text)
 
+    def send_responses(self, room_id, response_message):
         if response_message:
-            # Allow for a list response
-            if type(response_message) is not list:
+            # Allow for a list or generator of responses
+            if not isinstance(response_message, (list, GeneratorType)):
                 response_message = [response_message]
             for response in response_message:
                 # Response will be dict if it is an adaptivecard
                 if type(response) is dict:
                     self.api.messages.create(
-                        roomId=room.id,
+                        roomId=room_id,
                         text=response['content']['fallbackText'],
                         attachments=[response])
                 else:
-                    try:
-                        self.api.messages.create(roomId=room.id,
-                                                 markdown=str(response))
-
-                    # Sometimes the message is too long so we will split it in half
-                    except ApiError as e:
-                        if "length limited" not in e.message.lower():
-                            raise ApiError(e.response)
-                        parts = str(response).split('\n')
-                        part_1 = '\n'.join(parts[0:int(len(parts) / 2)])
-                        part_2 = '\n'.join(parts[int(len(parts) / 2):])
-                        self.api.messages.create(roomId=room.id,
-                                                 markdown=str(part_1))
-                        self.api.messages.create(roomId=room.id,
-                                                 markdown=str(part_2))
-
-        response_text = {"message": "OK"}
-        return jsonify(response_text)
+                    self.api.messages.create(roomId=room_id,
+                                             markdown=str(response))
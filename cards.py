@@ -0,0 +1,116 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import threading
+
+import catalog
+import utils
+
+
+# Keeps the rendered adaptive card attachments for each switch so they
+# don't have to be rebuilt on every conversion. The attachments are shared
+# between requests so they must not be modified.
+class CardCache():
+    def __init__(self, switch_index=None):
+        super().__init__()
+        self.switch_index = switch_index or catalog.switch_index
+        self._lock = threading.Lock()
+        # Switch ID => {original model => attachment}
+        self._cards = {}
+        self._version = None
+        # Bumped whenever cards are dropped so a render that was already
+        # in progress doesn't store a stale card
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self):
+        # A full reload of the catalog means any card could be out of date
+        if self._version != self.switch_index.version:
+            self._cards = {}
+            self._version = self.switch_index.version
+            self._generation += 1
+
+    def get(self, switch, original_model=None):
+        key = switch.id.lower()
+        with self._lock:
+            self._check_version()
+            attachment = self._cards.get(key, {}).get(original_model, None)
+            if attachment:
+                self.hits += 1
+                return attachment
+            self.misses += 1
+            generation = self._generation
+
+        attachment = utils.Responses.generate_model_response(
+            switch, original_model=original_model)
+
+        with self._lock:
+            if generation == self._generation:
+                self._cards.setdefault(key, {})[original_model] = attachment
+        return attachment
+
+    def invalidate(self, switch_id):
+        # Drops the cards for a switch, and the cards that name it as the
+        # original model
+        switch_id = switch_id.lower()
+        with self._lock:
+            self._cards.pop(switch_id, None)
+            for cards in self._cards.values():
+                for original_model in list(cards):
+                    if original_model and original_model.lower() == switch_id:
+                        del cards[original_model]
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._cards = {}
+            self._generation += 1
+
+    def warm(self, mapping_graph=None):
+        # Renders a card for every switch, and for both sides of every
+        # mapping as they are shown after a conversion
+        mapping_graph = mapping_graph or catalog.mapping_graph
+
+        count = 0
+        for switch in self.switch_index.all():
+            self.get(switch)
+            count += 1
+
+        for catalyst_id, meraki_id in mapping_graph.edges():
+            catalyst = self.switch_index.get(catalyst_id)
+            meraki = self.switch_index.get(meraki_id)
+            if not catalyst or not meraki:
+                continue
+            self.get(meraki, original_model=catalyst.id)
+            self.get(catalyst, original_model=meraki.id)
+            count += 2
+
+        return count
+
+    def stats(self):
+        with self._lock:
+            return {
+                "switches": len(self._cards),
+                "cards": sum(len(cards) for cards in self._cards.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+card_cache = CardCache()
@@ -0,0 +1,417 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import bisect
+import threading
+
+from sqlalchemy.exc import InvalidRequestError
+
+import models
+
+
+def split_segments(value):
+    # Model numbers are broken up by dashes, e.g. C9300L-48T-4G-E
+    return tuple(value.lower().split("-"))
+
+
+def segments_match(search, target):
+    # Mirrors the old SQL wildcard match where C9300L-48T became %C9300L%-%48T%
+    # Each search segment has to appear inside a later segment of the target
+    position = 0
+    for segment in search:
+        while position < len(target) and segment not in target[position]:
+            position += 1
+        if position == len(target):
+            return False
+        position += 1
+    return True
+
+
+class SwitchEntry():
+    def __init__(self, switch):
+        self.switch = switch
+        self.id = switch.id.lower()
+        self.model = switch.model.lower() if switch.model else None
+        self.network_module = switch.network_module.lower() \
+            if switch.network_module else None
+
+        self.id_segments = split_segments(switch.id)
+        self.model_segments = split_segments(switch.model) \
+            if switch.model else None
+        self.network_module_segments = split_segments(switch.network_module) \
+            if switch.network_module else None
+
+
+class SwitchIndex():
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = None
+        self._by_id = {}
+        self._by_model = {}
+        self._network_modules = {}
+        # Bumped by full reloads and invalidate(), whenever any switch
+        # could have changed
+        self.version = 0
+        # Bumped by any change, including a single switch being refreshed
+        self.revision = 0
+
+    def load(self):
+        try:
+            # The index outlives any request so it gets its own session
+            db_session = models.session_factory()
+
+            switches = db_session.query(models.Switch) \
+                        .order_by(models.Switch.id) \
+                        .all()
+
+            entries = [SwitchEntry(switch) for switch in switches]
+
+            with self._lock:
+                self._build(entries)
+                self.version += 1
+                self.revision += 1
+
+            return True
+
+        except InvalidRequestError:
+            # An SQL error will occur if the database is being spammed
+            db_session.rollback()
+            return False
+
+        finally:
+            db_session.close()
+
+    def _build(self, entries):
+        by_id = {}
+        by_model = {}
+        network_modules = {}
+        for entry in entries:
+            by_id[entry.id] = entry
+            if entry.model:
+                by_model.setdefault(entry.model, []).append(entry)
+            if entry.network_module:
+                network_modules[entry.network_module] = \
+                    entry.switch.network_module
+
+        self._entries = entries
+        self._by_id = by_id
+        self._by_model = by_model
+        self._network_modules = network_modules
+
+    def invalidate(self):
+        # The index will be rebuilt on the next lookup. Bumping the version
+        # now means anything cached from it, such as the cards, is dropped
+        # straight away even if nothing looks a switch up in the meantime.
+        with self._lock:
+            self._entries = None
+            self.version += 1
+            self.revision += 1
+
+    # Reloads a single switch after it has been added, edited or removed.
+    # Unlike invalidate() this keeps the version, so anything cached for
+    # other switches stays valid.
+    def refresh(self, id):
+        try:
+            db_session = models.session_factory()
+
+            switch = db_session.query(models.Switch) \
+                        .filter(models.Switch.id == id) \
+                        .one_or_none()
+
+            with self._lock:
+                # Nothing to keep in sync until the index is first read
+                if self._entries is None:
+                    return True
+
+                entries = list(self._entries)
+                ids = [entry.id for entry in entries]
+                if id.lower() in ids:
+                    # Edited switches keep their place in the order
+                    index = ids.index(id.lower())
+                    if switch:
+                        entries[index] = SwitchEntry(switch)
+                    else:
+                        del entries[index]
+                elif switch:
+                    entries.insert(bisect.bisect(ids, id.lower()),
+                                   SwitchEntry(switch))
+                self._build(entries)
+                self.revision += 1
+
+            return True
+
+        except InvalidRequestError:
+            # An SQL error will occur if the database is being spammed
+            db_session.rollback()
+            self.invalidate()
+            return False
+
+        finally:
+            db_session.close()
+
+    def get(self, id):
+        _, by_id, _ = self._get_entries()
+        entry = by_id.get(id.lower(), None)
+        return entry.switch if entry else None
+
+    def _get_entries(self):
+        with self._lock:
+            if self._entries is None:
+                self.load()
+            return self._entries or [], self._by_id, self._by_model
+
+    def all(self):
+        entries, _, _ = self._get_entries()
+        return [entry.switch for entry in entries]
+
+    # Returns the (model, network module) a single token refers to, or None
+    def lookup_model(self, token):
+        _, by_id, by_model = self._get_entries()
+
+        token = token.lower()
+        for candidate in (token, token + "-hw"):
+            if candidate in by_model:
+                return by_model[candidate][0].switch.model, None
+            # Modular switch IDs are the model and network module combined
+            if candidate in by_id:
+                switch = by_id[candidate].switch
+                return switch.model, switch.network_module
+
+        return None
+
+    def lookup_network_module(self, token):
+        self._get_entries()
+        network_modules = self._network_modules
+
+        token = token.lower()
+        if token in network_modules:
+            return network_modules[token]
+
+        # Allow the vendor prefix to be left off, e.g. MOD-2X40G
+        matches = [
+            value for key, value in network_modules.items()
+            if key.endswith("-" + token)
+        ]
+        if len(matches) == 1:
+            return matches[0]
+
+        return None
+
+    def _filter(self, fuzzy_match, id, model, network_module):
+        entries, by_id, by_model = self._get_entries()
+
+        # Narrow the candidates down with a dictionary hit where possible
+        if not fuzzy_match and model:
+            candidates = by_model.get(model.lower(), [])
+        elif not fuzzy_match and id:
+            candidates = [by_id[id.lower()]] if id.lower() in by_id else []
+        else:
+            candidates = entries
+
+        matches = []
+        for entry in candidates:
+            if model and not self._field_match(fuzzy_match, model, entry.model,
+                                               entry.model_segments):
+                continue
+            if network_module and not self._field_match(
+                    fuzzy_match, network_module, entry.network_module,
+                    entry.network_module_segments):
+                continue
+            if id and not self._field_match(fuzzy_match, id, entry.id,
+                                            entry.id_segments):
+                continue
+            matches.append(entry.switch)
+
+        return matches
+
+    @staticmethod
+    def _field_match(fuzzy_match, search, value, segments):
+        # Null columns never matched a LIKE filter
+        if value is None:
+            return False
+        if fuzzy_match:
+            return segments_match(split_segments(search), segments)
+        return search.lower() == value
+
+    # Resolves a batch of switch IDs in one pass over the index
+    # Exact hits come from the dictionary, leftovers get a single fuzzy sweep
+    # Returns each ID's switches keyed on the ID
+    def group_by_ids(self, ids):
+        entries, by_id, _ = self._get_entries()
+
+        matches = {}
+        leftovers = []
+        for id in ids:
+            entry = by_id.get(id.lower(), None)
+            if entry:
+                matches[id] = [entry.switch]
+            elif id not in matches:
+                matches[id] = []
+                leftovers.append((id, split_segments(id)))
+
+        if leftovers:
+            for entry in entries:
+                for id, segments in leftovers:
+                    if segments_match(segments, entry.id_segments):
+                        matches[id].append(entry.switch)
+
+        return matches
+
+    def find_by_ids(self, ids):
+        matches = self.group_by_ids(ids)
+        switches = []
+        for id in ids:
+            switches.extend(matches[id])
+        return switches
+
+    # Same result semantics as the original LIKE fallback chain:
+    # exact match, then the Meraki -HW suffix, then the segment fuzzy match
+    def find(self,
+             fuzzy_match=False,
+             expand=True,
+             id=None,
+             model=None,
+             network_module=None,
+             add_meraki_hw_suffix=False):
+        if model and add_meraki_hw_suffix and not model.lower().endswith(
+                "hw"):
+            model = model + "-HW"
+
+        switches = self._filter(fuzzy_match, id, model, network_module)
+
+        # Do a fuzzy match if a direct match wasn't found
+        if len(switches) == 0 and model and model[0].lower(
+        ) == "m" and not add_meraki_hw_suffix and expand:
+            return self.find(fuzzy_match=fuzzy_match,
+                             model=model,
+                             network_module=network_module,
+                             id=id,
+                             add_meraki_hw_suffix=True)
+        if len(switches) == 0 and not fuzzy_match and expand:
+            return self.find(fuzzy_match=True,
+                             model=model,
+                             network_module=network_module,
+                             id=id,
+                             add_meraki_hw_suffix=add_meraki_hw_suffix)
+
+        return switches
+
+
+class MappingGraph():
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._edges = None
+        self._catalyst = {}
+        self._meraki = {}
+
+    def load(self):
+        try:
+            # The index outlives any request so it gets its own session
+            db_session = models.session_factory()
+
+            mapping = db_session.query(models.Mapping) \
+                        .order_by(models.Mapping.id) \
+                        .all()
+
+            with self._lock:
+                self._edges = {}
+                self._catalyst = {}
+                self._meraki = {}
+                for m in mapping:
+                    self._add_edge(m.id, m.catalyst, m.meraki)
+
+            return True
+
+        except InvalidRequestError:
+            # An SQL error will occur if the database is being spammed
+            db_session.rollback()
+            return False
+
+        finally:
+            db_session.close()
+
+    def invalidate(self):
+        # The graph will be rebuilt on the next lookup
+        with self._lock:
+            self._edges = None
+
+    def _ensure_loaded(self):
+        if self._edges is None:
+            self.load()
+        return self._edges is not None
+
+    def _add_edge(self, mapping_id, catalyst, meraki):
+        self._edges[mapping_id] = (catalyst, meraki)
+        self._catalyst.setdefault(catalyst.lower(), []).append(meraki)
+        self._meraki.setdefault(meraki.lower(), []).append(catalyst)
+
+    def add(self, mapping_id, catalyst, meraki):
+        with self._lock:
+            # Nothing to keep in sync until the graph is first read
+            if self._edges is None:
+                return
+            self._add_edge(mapping_id, catalyst, meraki)
+
+    def remove(self, mapping_id):
+        with self._lock:
+            if self._edges is None or mapping_id not in self._edges:
+                return
+            catalyst, meraki = self._edges.pop(mapping_id)
+
+            merakis = self._catalyst.get(catalyst.lower(), [])
+            merakis.remove(meraki)
+            if not merakis:
+                del self._catalyst[catalyst.lower()]
+
+            catalysts = self._meraki.get(meraki.lower(), [])
+            catalysts.remove(catalyst)
+            if not catalysts:
+                del self._meraki[meraki.lower()]
+
+    def edges(self):
+        with self._lock:
+            if not self._ensure_loaded():
+                return []
+            return list(self._edges.values())
+
+    # Returns the switch IDs on the other side of the mapping, or None
+    def neighbours(self, id, fuzzy_match=False):
+        with self._lock:
+            if not self._ensure_loaded():
+                return None
+
+            # Meraki models always start with M
+            meraki = id[0].lower() == "m"
+
+            if not fuzzy_match:
+                adjacency = self._meraki if meraki else self._catalyst
+                matches = adjacency.get(id.lower(), None)
+                return list(matches) if matches else None
+
+            search = id.lower()
+            matches = []
+            for catalyst, other in self._edges.values():
+                if meraki and search in other.lower():
+                    matches.append(catalyst)
+                elif not meraki and search in catalyst.lower():
+                    matches.append(other)
+            return matches or None
+
+
+# Shared across the app so that editing can refresh what conversion reads
+switch_index = SwitchIndex()
+mapping_graph = MappingGraph()
@@ -15,22 +15,55 @@ IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied.
 """
 
-import dialogflow
+import os
+
 import sqlalchemy as db
+from google.protobuf.json_format import MessageToDict
 from sqlalchemy.exc import InvalidRequestError
 from sqlalchemy.orm import sessionmaker
 
+import catalog
+import metrics
 import models
+from cache import Lazy, TTLCache
+from equivalence import equivalence_engine
+
+# DialogFlow adds this context to most responses, it doesn't carry conversation state
+SYSTEM_CONTEXT = "__system_counters__"
+
+
+def normalise_text(text):
+    # Collapse case, whitespace and trailing punctuation so repeats share a key
+    return " ".join(text.lower().split()).rstrip("?!. ")
+
+
+def create_session_client():
+    # The DialogFlow client library is slow to import, so it's left until
+    # it's used
+    import dialogflow
+
+    return dialogflow.SessionsClient()
 
 
 class Converter:
     def __init__(self, project_id, session_id):
         super().__init__()
         self.project_id = project_id
-        self.df_session_client = dialogflow.SessionsClient()
+        # Created the first time a message needs DialogFlow
+        self.df_session_client = Lazy(create_session_client)
+
+        # Parsed DialogFlow results keyed on the normalised text and language
+        self.intent_cache = TTLCache(
+            maxsize=int(os.getenv("INTENT_CACHE_SIZE", 1024)),
+            ttl=int(os.getenv("INTENT_CACHE_TTL", 3600)))
+        # Sessions that DialogFlow is holding an active context for
+        self.context_sessions = TTLCache(maxsize=4096, ttl=20 * 60)
 
+    @metrics.dependency("dialogflow", "detect_intent")
     def detect_intent_texts(self, session_id, text, language_code):
         if text:
+            import dialogflow
+
             df_session = self.df_session_client.session_path(
                 self.project_id, session_id)
 
@@ -43,6 +76,44 @@ class Converter:
 
             return response.query_result
 
+    @metrics.span()
+    def detect_intent(self, session_id, text, language_code):
+        if not text:
+            return None
+
+        key = (normalise_text(text), language_code)
+
+        # A session in the middle of a conversation depends on its context,
+        # so the same text could mean something different there
+        if session_id not in self.context_sessions:
+            result = self.intent_cache.get(key)
+            if result:
+                return dict(result, cached=True)
+
+        query_result = self.detect_intent_texts(session_id, text,
+                                                language_code)
+
+        result = {
+            "intent": query_result.intent.display_name,
+            "parameters": MessageToDict(query_result.parameters),
+            "fulfillment_text": query_result.fulfillment_text,
+            "cached": False,
+        }
+
+        contexts = [
+            context for context in query_result.output_contexts
+            if not context.name.endswith(SYSTEM_CONTEXT)
+        ]
+        if contexts:
+            # Don't cache anything that started or continued a conversation
+            self.context_sessions.set(session_id, True)
+        else:
+            self.context_sessions.pop(session_id)
+            self.intent_cache.set(key, result)
+
+        return result
+
+    @metrics.span()
     def find_equivalent_switch(self, fields):
         try:
             model = fields.get("Model", None)
@@ -54,6 +125,7 @@ class Converter:
             data["modular"] = False
             data["switches"] = []
             data["matched_model"] = None
+            data["nearest"] = []
 
             db_session = models.Session()
 
@@ -67,20 +139,16 @@ class Converter:
                 
                 mapping_ids = self.find_switch_mapping(db_session,
                                                        requested_switch[0].id)
-                # Could not find an equivalent
+                # Could not find an equivalent, offer the closest by specs
                 if not mapping_ids:
                     data["matched"] = True
+                    data["nearest"] = equivalence_engine.nearest(
+                        requested_switch[0])
                     return data
-                equivalent_switch = []
-                for mapping_id in mapping_ids:
-                    matches = self.find_switch_by_id(db_session, mapping_id)
-                    if len(matches) == 0:
-                        matches.extend(
-                            self.find_switch_by_id(db_session,
-                                                   mapping_id,
-                                                   expand=True))
-                    equivalent_switch.extend(matches)
-                    # Pass the data back
+                # Resolve every mapped ID at once rather than one query each
+                equivalent_switch = catalog.switch_index.find_by_ids(
+                    mapping_ids)
+                # Pass the data back
                 data["switches"] = equivalent_switch
                 data["matched"] = True
             # Did not find any matching switch
@@ -102,11 +170,12 @@ class Converter:
             return data
 
         finally:
-            db_session.close()
+            models.release_session(db_session)
 
     # To fuzzy match we will inlude wildcards in between each model break
     # E.g. C9300L-48T-4G-E -> %C9300L%-%48T%-%4G%-%E%
     # This will ensure that C9300L-48T will match switches in that family
+    # The matching is answered from the in-memory catalog index
     def find_switches_with_filters(self,
                                    db_session,
                                    fuzzy_match=False,
@@ -115,48 +184,13 @@ class Converter:
                                    model=None,
                                    network_module=None,
                                    add_meraki_hw_suffix=False):
-        switches = db_session.query(models.Switch)
-
-        # Filter based on passed parameters
-        if model and model != '':
-            if add_meraki_hw_suffix and not model.lower().endswith("hw"):
-                model = model + "-HW"
-            if fuzzy_match:
-                model = '%' + model.replace("-", "%-%") + '%'
-            switches = switches.filter(models.Switch.model.like(f"{model}"))
-        if network_module and network_module != '':
-            if fuzzy_match:
-                network_module = '%' + network_module.replace("-", "%-%") + '%'
-            switches = switches.filter(
-                models.Switch.network_module.like(f"{network_module}"))
-        if id and id != '':
-            if fuzzy_match:
-                id = '%' + id.replace("-", "%-%") + '%'
-            switches = switches.filter(models.Switch.id.like(f"{id}"))
-
-        # Get all switches from the query
-        switches = switches.all()
-
-        # Do a recursive fuzzy match if a direct match wasn't found
-        if len(switches) == 0 and model and model[0].lower(
-        ) == "m" and not add_meraki_hw_suffix and expand:
-            return self.find_switches_with_filters(
-                db_session,
-                fuzzy_match=fuzzy_match,
-                model=model,
-                network_module=network_module,
-                id=id,
-                add_meraki_hw_suffix=True)
-        if len(switches) == 0 and not fuzzy_match and expand:
-            return self.find_switches_with_filters(
-                db_session,
-                fuzzy_match=True,
-                model=model,
-                network_module=network_module,
-                id=id,
-                add_meraki_hw_suffix=add_meraki_hw_suffix)
-
-        return switches
+        return catalog.switch_index.find(
+            fuzzy_match=fuzzy_match,
+            expand=expand,
+            id=id,
+            model=model,
+            network_module=network_module,
+            add_meraki_hw_suffix=add_meraki_hw_suffix)
 
     def find_switch_by_id(self, db_session, id, expand=False):
         return self.find_switches_with_filters(db_session,
@@ -168,25 +202,12 @@ class Converter:
                                                model=model,
                                                expand=expand)
 
+    @metrics.span()
     def find_switch_mapping(self, db_session, id, fuzzy_match=False):
-        # If doing a fuzzy match, add % onto the ends
-        if fuzzy_match:
-            search = f"%{id}%"
-        else:
-            search = id
-
-        # Meraki models always start with M
-        if id[0].lower() == "m":
-            matches = db_session.query(models.Mapping).filter(
-                models.Mapping.meraki.like(search)).all()
-            if matches:
-                return [m.catalyst for m in matches]
-                # return matches[0].catalyst
-        else:
-            matches = db_session.query(models.Mapping).filter(
-                models.Mapping.catalyst.like(search)).all()
-            if matches:
-                return [m.meraki for m in matches]
+        # Mapping is answered from the in-memory catalyst<=>meraki graph
+        matches = catalog.mapping_graph.neighbours(id, fuzzy_match=fuzzy_match)
+        if matches:
+            return matches
 
         if __debug__:
             print(f"Error could not find mapping for {id}")
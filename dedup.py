@@ -0,0 +1,144 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import sqlite3
+import threading
+import time
+
+from cache import TTLCache
+
+# Expired keys are swept from the SQLite store every this many claims
+SWEEP_EVERY = 100
+
+
+def webhook_key(json_data):
+    # Webex sends the same data ID again when it redelivers a webhook,
+    # e.g. "messages.created.Y2lzY29zcGFyazovL..."
+    data = json_data.get("data", None) or {}
+    if not data.get("id", None):
+        return None
+    return f"{json_data.get('resource', '')}.{json_data.get('event', '')}.{data['id']}"
+
+
+class MemoryDedupStore():
+    # Remembers the webhooks this process has seen for ttl seconds
+    def __init__(self, ttl=600, maxsize=10000):
+        super().__init__()
+        self.seen = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.duplicates = 0
+
+    def claim(self, key):
+        # True the first time a key is seen within the window
+        if self.seen.add(key, True):
+            return True
+        self.duplicates += 1
+        return False
+
+    def release(self, key):
+        # Lets a webhook that failed be processed again when it's retried
+        self.seen.pop(key)
+
+    def stats(self):
+        return {
+            "size": len(self.seen),
+            "maxsize": self.seen.maxsize,
+            "duplicates": self.duplicates
+        }
+
+
+class SQLiteDedupStore():
+    # Shares the webhooks seen between processes, e.g. several gunicorn
+    # workers, through a SQLite file on the same machine
+    def __init__(self, path, ttl=600, maxsize=10000):
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.duplicates = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._claims = 0
+
+        connection = self._connect()
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS webhook_seen ("
+                               "key TEXT PRIMARY KEY, expires REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS webhook_seen_expires "
+                               "ON webhook_seen (expires)")
+
+    def _connect(self):
+        # SQLite connections can't be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def claim(self, key):
+        now = time.time()
+        connection = self._connect()
+        with connection:
+            # An expired claim doesn't count
+            connection.execute(
+                "DELETE FROM webhook_seen WHERE key = ? AND expires <= ?",
+                (key, now))
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO webhook_seen (key, expires) VALUES (?, ?)",
+                (key, now + self.ttl))
+            claimed = cursor.rowcount == 1
+
+        with self._lock:
+            self._claims += 1
+            sweep = self._claims % SWEEP_EVERY == 0
+            if not claimed:
+                self.duplicates += 1
+        if sweep:
+            self.sweep()
+        return claimed
+
+    def release(self, key):
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM webhook_seen WHERE key = ?",
+                               (key, ))
+
+    def sweep(self):
+        # Drops expired keys, then the oldest ones beyond maxsize
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM webhook_seen WHERE expires <= ?",
+                               (time.time(), ))
+            connection.execute(
+                "DELETE FROM webhook_seen WHERE key IN (SELECT key FROM webhook_seen "
+                "ORDER BY expires DESC LIMIT -1 OFFSET ?)", (self.maxsize, ))
+
+    def stats(self):
+        size = self._connect().execute(
+            "SELECT COUNT(*) FROM webhook_seen").fetchone()[0]
+        return {
+            "size": size,
+            "maxsize": self.maxsize,
+            "duplicates": self.duplicates
+        }
+
+
+def create_store(path=None, ttl=600, maxsize=10000):
+    # In-process unless a SQLite file is given to share between workers
+    if path:
+        return SQLiteDedupStore(path, ttl=ttl, maxsize=maxsize)
+    return MemoryDedupStore(ttl=ttl, maxsize=maxsize)
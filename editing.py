@@ -15,69 +15,99 @@ IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied.
 """
 
+import os
+import threading
+import time
+
 import sqlalchemy as db
 from sqlalchemy import or_
 from sqlalchemy.exc import InvalidRequestError
 from sqlalchemy.orm import sessionmaker
 
+import catalog
+import metrics
 import models
+from cards import card_cache
 from utils import Results
 
 
 class Editor():
     def __init__(self):
-        pass
-
-    def get_approved_users(self, db_session=None):
-        # Reuse an existing session if it is passed
-        if db_session:
-            users = db_session.query(models.User).all()
+        # In-memory copy of the users table so permission checks need no I/O
+        self._users = None
+        self._users_expiry = 0
+        self._users_lock = threading.Lock()
+        # Other processes can change the table, so reload it now and then
+        self.users_ttl = int(os.getenv("PERMISSION_CACHE_TTL", 60))
+
+    def _get_user_table(self):
+        with self._users_lock:
+            if self._users is not None and time.monotonic(
+            ) < self._users_expiry:
+                return self._users
 
-            return users
-
-        # Create a new db session
-        else:
             try:
-                db_session = models.Session()
+                # The table outlives any request so it gets its own session
+                db_session = models.session_factory()
 
                 users = db_session.query(models.User).all()
 
-                return users
+                self._users = {user.id.lower(): user for user in users}
+                self._users_expiry = time.monotonic() + self.users_ttl
 
             except InvalidRequestError:
                 # An SQL error will occur if the database is being spammed
                 db_session.rollback()
-                return False
 
             finally:
                 db_session.close()
 
-    def get_admin_users(self, db_session=None):
+            return self._users
+
+    def _cache_user(self, username, privilege):
+        with self._users_lock:
+            if self._users is None:
+                return
+            if privilege:
+                self._users[username.lower()] = models.User(
+                    id=username, privilege=privilege)
+            else:
+                self._users.pop(username.lower(), None)
+
+    @metrics.span()
+    def get_approved_users(self, db_session=None):
         # Reuse an existing session if it is passed
         if db_session:
-            users = db_session.query(models.User).filter(
-                models.User.privilege.like("admin")).all()
+            users = db_session.query(models.User).all()
 
             return users
 
-        # Create a new db session
+        # Read from the cached users table
         else:
-            try:
-                db_session = models.Session()
+            users = self._get_user_table()
+            if users is None:
+                return False
 
-                users = db_session.query(models.User).filter(
-                    models.User.privilege.like("admin")).all()
+            return list(users.values())
 
-                return users
+    @metrics.span()
+    def get_admin_users(self, db_session=None):
+        # Reuse an existing session if it is passed
+        if db_session:
+            users = db_session.query(models.User).filter(
+                models.User.privilege.like("admin")).all()
 
-            except InvalidRequestError:
-                # An SQL error will occur if the database is being spammed
-                db_session.rollback()
+            return users
+
+        # Read from the cached users table
+        else:
+            users = self._get_user_table()
+            if users is None:
                 return False
 
-            finally:
-                db_session.close()
+            return [user for user in users.values() if user.is_admin()]
 
+    @metrics.span()
     def can_user_edit(self, username, db_session=None):
         # Reuse an existing session if it is passed
         if db_session:
@@ -91,26 +121,18 @@ class Editor():
         elif not username:
             return False
 
-        # Create a new db session
+        # Read from the cached users table
         else:
-            try:
-                db_session = models.Session()
-
-                user = db_session.query(
-                    models.User).filter(models.User.id == username).all()
-
-                if len(user) == 1:
-                    return user[0].can_edit()
+            users = self._get_user_table()
+            if not users:
                 return False
 
-            except InvalidRequestError:
-                # An SQL error will occur if the database is being spammed
-                db_session.rollback()
-                return False
-
-            finally:
-                db_session.close()
+            user = users.get(username.lower(), None)
+            if user:
+                return user.can_edit()
+            return False
 
+    @metrics.span()
     def allow_user_by_id(self, me, username):
         try:
             db_session = models.Session()
@@ -128,6 +150,7 @@ class Editor():
             db_session.add(new_user)
 
             db_session.commit()
+            self._cache_user(username, "editor")
 
             return f"Successfully added {username} to the allowed editors list."
 
@@ -137,8 +160,9 @@ class Editor():
             return f"Encountered an error please try again later."
 
         finally:
-            db_session.close()
+            models.release_session(db_session)
 
+    @metrics.span()
     def disallow_user_by_id(self, me, person_id):
         try:
             db_session = models.Session()
@@ -156,6 +180,7 @@ class Editor():
                     return f"User {person_id} is an admin and cannot be removed."
                 db_session.delete(user[0])
                 db_session.commit()
+                self._cache_user(person_id, None)
                 return f"Successfully removed {person_id} from the allowed editors list."
 
             return f"User {person_id} is not on the editors list."
@@ -166,8 +191,9 @@ class Editor():
             return f"Encountered an error please try again later."
 
         finally:
-            db_session.close()
+            models.release_session(db_session)
 
+    @metrics.span()
     def list_all_switches(self, parameters):
         # See if there is a filter
         parameters = [p.strip() for p in parameters.split(" ")]
@@ -194,8 +220,9 @@ class Editor():
             return f"Encountered an error please try again later."
 
         finally:
-            db_session.close()
+            models.release_session(db_session)
 
+    @metrics.span()
     def list_all_mapping(self, parameters):
         parameters = [p.strip() for p in parameters.split(" ")]
         if len(parameters) > 1:
@@ -223,8 +250,9 @@ class Editor():
             return f"Encountered an error please try again later."
 
         finally:
-            db_session.close()
+            models.release_session(db_session)
 
+    @metrics.span()
     def get_switch_by_id(self, id):
         try:
             db_session = models.Session()
@@ -244,32 +272,21 @@ class Editor():
             return f"Encountered an error please try again later."
 
         finally:
-            db_session.close()
+            models.release_session(db_session)
 
     def sanitise_inputs(self, values):
         for k, v in values.items():
+            field = models.SWITCH_FIELDS_BY_NAME.get(k, None)
+            if not field:
+                return f"Attribute {k} does not exist in models.Switch!"
             try:
-                # Convert to bool
-                if v == "false":
-                    values[k] = False
-                elif v == "true":
-                    values[k] = True
-
                 # Cast types to target type
-                target_type = str(getattr(models.Switch, k).type)
-                if target_type == "VARCHAR":
-                    values[k] = str(v)
-                elif target_type == "INTEGER":
-                    if v == None or v == "":
-                        v = 0
-                    values[k] = int(v)
-
-            except AttributeError:
-                return f"Attribute {k} does not exist in models.Switch!"
-            except ValueError:
-                return f"'{v}' is not valid for attribute {k}. Needs to be of type {target_type}"
+                values[k] = field.coerce(v)
+            except ValueError as e:
+                return f"{field.pretty_name}: {e}."
         return values
 
+    @metrics.span()
     def edit_switch_by_id(self, id, values):
         try:
             db_session = models.Session()
@@ -280,12 +297,18 @@ class Editor():
 
             # Edit existing entry
             if len(switch) == 1:
+                old_id = switch[0].id
                 for k, v, in values.items():
                     # need to type check the inputs here
 
                     if k in vars(models.Switch).keys():
                         switch[0].__setattr__(k, v)
+                switch_id = switch[0].id
                 db_session.commit()
+                # The edit may have changed the key as well
+                for changed_id in {old_id, switch_id}:
+                    catalog.switch_index.refresh(changed_id)
+                    card_cache.invalidate(changed_id)
                 return Results.EDIT
 
             # Create new entry
@@ -298,6 +321,8 @@ class Editor():
 
                 db_session.add(new_switch)
                 db_session.commit()
+                catalog.switch_index.refresh(new_switch.id)
+                card_cache.invalidate(new_switch.id)
                 return Results.NEW
 
             # Didn't match, probably more than one match
@@ -312,8 +337,9 @@ class Editor():
             return f"Encountered an error please try again later."
 
         finally:
-            db_session.close()
+            models.release_session(db_session)
 
+    @metrics.span()
     def remove_switch_by_id(self, id):
         try:
             db_session = models.Session()
@@ -323,8 +349,11 @@ class Editor():
                         .all()
 
             if len(switch) == 1:
+                switch_id = switch[0].id
                 db_session.delete(switch[0])
                 db_session.commit()
+                catalog.switch_index.refresh(switch_id)
+                card_cache.invalidate(switch_id)
                 return f"Successfully removed **{id}** from the database."
 
             return f"Could not find **{id}** in the database."
@@ -335,8 +364,9 @@ class Editor():
             return f"Encountered an error please try again later."
 
         finally:
-            db_session.close()
+            models.release_session(db_session)
 
+    @metrics.span()
     def remove_mapping_by_id(self, parameters):
         parameters = parameters.split(" ")
         if len(parameters) != 2:
@@ -356,8 +386,10 @@ class Editor():
                         .all()
 
             if len(mapping) == 1:
+                mapping_id = mapping[0].id
                 db_session.delete(mapping[0])
                 db_session.commit()
+                catalog.mapping_graph.remove(mapping_id)
                 return f"Successfully removed mapping **{parameters[0]}<=>{parameters[1]}** from the database."
 
             return f"Could not find **{parameters[0]}<=>{parameters[1]}** in the database."
@@ -368,8 +400,9 @@ class Editor():
             return f"Encountered an error please try again later."
 
         finally:
-            db_session.close()
+            models.release_session(db_session)
 
+    @metrics.span()
     def add_mapping_by_id(self, parameters):
         parameters = [p.strip() for p in parameters.split(" ")]
         if len(parameters) != 2:
@@ -402,6 +435,7 @@ class Editor():
                 mapping = models.Mapping(meraki=meraki, catalyst=catalyst)
                 db_session.add(mapping)
                 db_session.commit()
+                catalog.mapping_graph.add(mapping.id, catalyst, meraki)
                 return f"Successfully added mapping **{parameters[0]}<=>{parameters[1]}** to the database."
 
             return f"Could not find **{parameters[0]}<=>{parameters[1]}** in the database."
@@ -412,4 +446,4 @@ class Editor():
             return f"Encountered an error please try again later."
 
         finally:
-            db_session.close()
+            models.release_session(db_session)
@@ -0,0 +1,209 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import threading
+
+import numpy as np
+
+import catalog
+import metrics
+import models
+
+# Downlinks that can power a device
+POE_DOWNLINKS = ("dl_ge_poe", "dl_ge_poep", "dl_ge_upoe", "dl_ge_upoep",
+                 "dl_2ge_upoe", "dl_mgig_poep", "dl_mgig_upoe")
+
+# Gbps per uplink port
+UPLINK_SPEEDS = {
+    "ul_ge_sfp": 1,
+    "ul_mgig": 10,
+    "ul_10ge_sfpp": 10,
+    "ul_25ge_sfp28": 25,
+    "ul_40ge_qsfpp": 40,
+    "ul_100ge_qsfp28": 100,
+}
+
+# Totals worked out from the port columns, so that e.g. 48 PoE+ ports
+# still look close to 48 UPoE+ ports
+TOTALS = {
+    "Downlinks": lambda switch: sum(
+        getattr(switch, field.name) or 0 for field in models.SWITCH_FIELDS
+        if field.name.startswith("dl_")),
+    "PoE Downlinks": lambda switch: sum(
+        getattr(switch, name) or 0 for name in POE_DOWNLINKS),
+    "Uplink Bandwidth (Gbps)": lambda switch: sum(
+        (getattr(switch, name) or 0) * speed
+        for name, speed in UPLINK_SPEEDS.items()),
+}
+
+# How much each feature counts towards the distance, anything not listed
+# here (the individual port columns) counts 0.1. Shortfalls are only
+# reported for the features listed.
+WEIGHTS = {
+    "Downlinks": 4.0,
+    "PoE Downlinks": 3.0,
+    "Uplink Bandwidth (Gbps)": 3.0,
+    "poe_power": 2.0,
+    "switching_capacity": 2.0,
+    "mac_entry": 1.0,
+    "vlan": 0.5,
+}
+DEFAULT_WEIGHT = 0.1
+
+# Falling short of the original counts this many times more than going
+# over it, as a bigger switch is still a valid replacement
+DEFICIT_PENALTY = 3.0
+
+# Results are dropped below this confidence
+MIN_CONFIDENCE = 0.5
+
+
+def is_meraki(id):
+    # Meraki models always start with M
+    return id[0].lower() == "m"
+
+
+class Feature():
+    def __init__(self, name, pretty_name, value, weight):
+        super().__init__()
+        self.name = name
+        self.pretty_name = pretty_name
+        self.value = value
+        self.weight = weight
+
+
+def _column_value(name):
+    return lambda switch: getattr(switch, name) or 0
+
+
+FEATURES = [
+    Feature(field.name, field.pretty_name, _column_value(field.name),
+            WEIGHTS.get(field.name, DEFAULT_WEIGHT))
+    for field in models.SWITCH_FIELDS if field.type == int
+] + [
+    Feature(name, name, value, WEIGHTS.get(name, DEFAULT_WEIGHT))
+    for name, value in TOTALS.items()
+]
+
+
+class Equivalent():
+    def __init__(self, switch, distance, confidence, deficits):
+        super().__init__()
+        self.switch = switch
+        self.distance = distance
+        self.confidence = confidence
+        # Pretty feature name => how far short of the original it falls
+        self.deficits = deficits
+
+
+class Family():
+    # The switches of one platform held as a matrix, a row per switch
+    def __init__(self, switches, raw, scaled):
+        super().__init__()
+        self.switches = switches
+        self.raw = raw
+        self.scaled = scaled
+
+
+class EquivalenceEngine():
+    # Finds the closest switches on the other platform by their specs, for
+    # switches without an explicit mapping
+    def __init__(self, switch_index=None):
+        super().__init__()
+        self.switch_index = switch_index or catalog.switch_index
+        self._lock = threading.Lock()
+        self._revision = None
+        self._families = {}
+        self._scale = None
+        self._weights = np.array([feature.weight for feature in FEATURES])
+        self._weights = self._weights / self._weights.sum()
+
+    @staticmethod
+    def vector(switch):
+        return [feature.value(switch) for feature in FEATURES]
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._revision == self.switch_index.revision:
+                return self._families, self._scale
+
+            switches = self.switch_index.all()
+            raw = np.array([self.vector(switch) for switch in switches],
+                           dtype=float).reshape(len(switches), len(FEATURES))
+
+            # Log scale so that 8 v 12 ports matters about as much as 32 v 48,
+            # then divide by the largest in the catalog so every feature
+            # ends up between 0 and 1
+            scale = np.log1p(raw).max(axis=0) if len(switches) else np.ones(
+                len(FEATURES))
+            scale[scale == 0] = 1.0
+            scaled = np.log1p(raw) / scale
+
+            meraki = np.array([is_meraki(switch.id) for switch in switches],
+                              dtype=bool)
+            families = {}
+            for key, mask in ((True, meraki), (False, ~meraki)):
+                families[key] = Family(
+                    [switch for switch, keep in zip(switches, mask) if keep],
+                    raw[mask], scaled[mask])
+
+            self._families = families
+            self._scale = scale
+            self._revision = self.switch_index.revision
+            return families, scale
+
+    @metrics.span()
+    def nearest(self, switch, k=3, min_confidence=MIN_CONFIDENCE):
+        # Returns up to k Equivalents from the other platform, closest first
+        families, scale = self._ensure_loaded()
+        family = families.get(not is_meraki(switch.id), None)
+        if family is None or not family.switches:
+            return []
+
+        raw = np.array(self.vector(switch), dtype=float)
+        target = np.log1p(raw) / scale
+
+        # Weighted distance over every switch at once, with shortfalls
+        # counting more than surpluses
+        difference = family.scaled - target
+        penalty = np.where(difference < 0, DEFICIT_PENALTY, 1.0)
+        distances = np.sqrt(
+            (penalty * difference**2 * self._weights).sum(axis=1))
+        # Identical specs score 1, missing everything scores about 0
+        confidences = np.exp(-3.0 * distances)
+
+        # Stable so that ties keep the catalog order
+        closest = np.argsort(distances, kind="stable")[:k]
+
+        results = []
+        for row in closest:
+            confidence = float(confidences[row])
+            if confidence < min_confidence:
+                break
+            shortfall = raw - family.raw[row]
+            deficits = {
+                FEATURES[i].pretty_name: int(shortfall[i])
+                for i in np.nonzero(shortfall > 0)[0]
+                if FEATURES[i].name in WEIGHTS
+            }
+            results.append(
+                Equivalent(family.switches[row], float(distances[row]),
+                           confidence, deficits))
+        return results
+
+
+equivalence_engine = EquivalenceEngine()
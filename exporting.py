@@ -0,0 +1,106 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import csv
+import io
+import os
+import tempfile
+import zipfile
+
+import models
+
+# Tables that can be exported, keyed on the name used in commands and URLs
+EXPORT_TABLES = {
+    "switches": models.Switch,
+    "mapping": models.Mapping,
+    "users": models.User,
+}
+
+
+def find_table(name):
+    # Be forgiving about plurals, e.g. /export switch or /export mappings
+    name = name.strip().lower()
+    for table_name, model in EXPORT_TABLES.items():
+        if name and (table_name.startswith(name) or name.startswith(
+                table_name.rstrip("s"))):
+            return table_name, model
+    return None, None
+
+
+class Exporter():
+    def __init__(self, batch_size=500):
+        super().__init__()
+        self.batch_size = batch_size
+
+    def iter_rows(self, model):
+        fields = models.describe(model)
+        yield [field.name for field in fields]
+
+        # The export can be slow so it gets a session of its own
+        db_session = models.session_factory()
+        try:
+            # Fetch plain tuples in batches rather than building ORM objects
+            rows = db_session.query(*[field.column for field in fields]) \
+                        .order_by(*model.__table__.primary_key.columns) \
+                        .execution_options(stream_results=True) \
+                        .yield_per(self.batch_size)
+
+            for row in rows:
+                yield [
+                    field.format(value) for field, value in zip(fields, row)
+                ]
+
+        finally:
+            db_session.close()
+
+    def iter_csv(self, model):
+        # Generates the CSV one line at a time
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in self.iter_rows(model):
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    def write_csv(self, path, model):
+        with open(path, "w", newline="") as f:
+            for line in self.iter_csv(model):
+                f.write(line)
+        return path
+
+    def write_zip(self, path, tables=None):
+        tables = tables or EXPORT_TABLES
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for table_name, model in tables.items():
+                # Spool each table through a temporary file to keep memory flat
+                with tempfile.TemporaryFile("w+", newline="") as f:
+                    for line in self.iter_csv(model):
+                        f.write(line)
+                    f.seek(0)
+                    with archive.open(f"{table_name}.csv", "w") as entry:
+                        for line in f:
+                            entry.write(line.encode("utf-8"))
+        return path
+
+    def export(self, directory, table_name=None):
+        # Returns the path of a CSV for one table, or a zip of all of them
+        if table_name:
+            return self.write_csv(
+                os.path.join(directory, f"meercat_{table_name}.csv"),
+                EXPORT_TABLES[table_name])
+        return self.write_zip(os.path.join(directory, "meercat_export.zip"))
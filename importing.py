@@ -0,0 +1,296 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import csv
+
+from sqlalchemy.exc import SQLAlchemyError
+
+import catalog
+import models
+
+# Stop listing validation errors after this many
+MAX_ERRORS = 10
+
+
+def batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class ImportResult():
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.errors = []
+        self.discarded = False
+
+    def discard(self):
+        # The transaction was rolled back, so nothing counted was written
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.discarded = True
+
+    def __str__(self):
+        if self.errors:
+            text = f"**Nothing was imported, {len(self.errors)} problem(s) were found in the {self.table_name} file:**\n\n"
+            for error in self.errors[:MAX_ERRORS]:
+                text += f"- {error}  \n"
+            if len(self.errors) > MAX_ERRORS:
+                text += f"- ...and {len(self.errors) - MAX_ERRORS} more  \n"
+            return text.strip()
+        if self.discarded:
+            return f"**Nothing was imported into {self.table_name}.**"
+
+        return f"**Imported {self.table_name}:** {self.inserted} inserted, {self.updated} updated, {self.unchanged} unchanged."
+
+
+class Importer():
+    def __init__(self, batch_size=500):
+        super().__init__()
+        self.batch_size = batch_size
+
+    def import_csv(self, lines):
+        # Works out which table the CSV is for from its header row
+        reader = csv.reader(lines)
+        header = [name.strip().lower() for name in next(reader, [])]
+
+        if "catalyst" in header and "meraki" in header:
+            return self.import_mapping(header, reader)
+        if "id" in header:
+            return self.import_switches(header, reader)
+
+        result = ImportResult("unknown")
+        result.errors.append(
+            "The header row needs to match an export of the switches or mapping table."
+        )
+        return result
+
+    def parse_switches(self, header, rows, result):
+        fields = models.SWITCH_FIELDS_BY_NAME
+        for name in header:
+            if name not in fields:
+                result.errors.append(f"Unknown column '{name}'.")
+        if result.errors:
+            return []
+        coercers = [fields[name].coerce for name in header]
+
+        records = []
+        seen = set()
+        # Line 1 is the header
+        for line, row in enumerate(rows, start=2):
+            if not any(value.strip() for value in row):
+                continue
+            if len(row) != len(header):
+                result.errors.append(
+                    f"Line {line} has {len(row)} values, expected {len(header)}."
+                )
+                continue
+
+            record = {}
+            for name, coerce, value in zip(header, coercers, row):
+                try:
+                    record[name] = coerce(value)
+                except ValueError as e:
+                    result.errors.append(f"Line {line}, {name}: {e}.")
+
+            id = record.get("id", None)
+            if id and id.lower() in seen:
+                result.errors.append(f"Line {line}, {id} appears twice.")
+            elif id:
+                seen.add(id.lower())
+                records.append(record)
+
+        return records
+
+    def import_switches(self, header, rows):
+        result = ImportResult("switches")
+
+        # Validate everything before touching the database
+        records = self.parse_switches(header, rows, result)
+        if result.errors:
+            return result
+
+        try:
+            db_session = models.session_factory()
+
+            self.apply_switches(db_session, header, records, result)
+            if result.errors:
+                db_session.rollback()
+                return result
+            db_session.commit()
+
+            if result.inserted or result.updated:
+                catalog.switch_index.invalidate()
+
+            return result
+
+        except SQLAlchemyError as e:
+            # Roll the whole import back so the catalog is left untouched
+            db_session.rollback()
+            result.errors.append(f"The database rejected the import: {e}")
+            return result
+
+        finally:
+            db_session.close()
+
+    # Diffs the records against the switch table and writes only the changes.
+    # The caller is responsible for committing.
+    def apply_switches(self, db_session, header, records, result):
+        # Read the current catalog as plain tuples to diff against
+        columns = [models.Switch.__table__.columns[name] for name in header]
+        id_column = header.index("id")
+        existing = {}
+        for row in db_session.query(*columns):
+            existing[row[id_column].lower()] = dict(zip(header, row))
+
+        inserts = []
+        updates = []
+        for record in records:
+            current = existing.get(record["id"].lower(), None)
+            if current is None:
+                missing = [
+                    name for name in models.REQUIRED_SWITCH_FIELDS
+                    if record.get(name, None) is None
+                ]
+                if missing:
+                    result.errors.append(
+                        f"{record['id']} is new so it needs {', '.join(missing)}."
+                    )
+                inserts.append(record)
+            elif current != dict(record, id=current["id"]):
+                # Keep the existing key in case only its case differs
+                updates.append(dict(record, id=current["id"]))
+            else:
+                result.unchanged += 1
+
+        if result.errors:
+            result.unchanged = 0
+            return
+
+        # Apply only the changed rows in batches, all in one transaction
+        for batch in batches(inserts, self.batch_size):
+            db_session.bulk_insert_mappings(models.Switch, batch)
+        for batch in batches(updates, self.batch_size):
+            db_session.bulk_update_mappings(models.Switch, batch)
+
+        result.inserted = len(inserts)
+        result.updated = len(updates)
+
+    def parse_mapping(self, header, rows, result):
+        catalyst_column = header.index("catalyst")
+        meraki_column = header.index("meraki")
+
+        pairs = []
+        for line, row in enumerate(rows, start=2):
+            if not any(value.strip() for value in row):
+                continue
+            if len(row) != len(header):
+                result.errors.append(
+                    f"Line {line} has {len(row)} values, expected {len(header)}."
+                )
+                continue
+
+            pairs.append((line, row[catalyst_column].strip(),
+                          row[meraki_column].strip()))
+
+        return pairs
+
+    def import_mapping(self, header, rows):
+        result = ImportResult("mapping")
+
+        pairs = self.parse_mapping(header, rows, result)
+        if result.errors:
+            return result
+
+        try:
+            db_session = models.session_factory()
+
+            self.apply_mapping(db_session, pairs, result)
+            if result.errors:
+                db_session.rollback()
+                return result
+            db_session.commit()
+
+            if result.inserted:
+                catalog.mapping_graph.invalidate()
+
+            return result
+
+        except SQLAlchemyError as e:
+            # Roll the whole import back so the catalog is left untouched
+            db_session.rollback()
+            result.errors.append(f"The database rejected the import: {e}")
+            return result
+
+        finally:
+            db_session.close()
+
+    # Works out which (line, catalyst, meraki) pairs aren't already mapped
+    # and returns them ready to insert, without writing anything. New pairs
+    # are checked against switch_ids, or the switch table if not given.
+    def check_mapping(self, db_session, pairs, result, switch_ids=None):
+        if switch_ids is None:
+            switch_ids = {
+                row[0].lower()
+                for row in db_session.query(models.Switch.id)
+            }
+        existing = {(row[0].lower(), row[1].lower())
+                    for row in db_session.query(models.Mapping.catalyst,
+                                                models.Mapping.meraki)}
+
+        inserts = []
+        seen = set()
+        for line, catalyst, meraki in pairs:
+            pair = (catalyst.lower(), meraki.lower())
+            if pair in existing or pair in seen:
+                result.unchanged += 1
+                continue
+
+            # New pairs have to point at switches that exist
+            for id in (catalyst, meraki):
+                if id.lower() not in switch_ids:
+                    result.errors.append(
+                        f"Line {line}, {id or 'an empty value'} is not a known switch."
+                    )
+            seen.add(pair)
+            inserts.append({"catalyst": catalyst, "meraki": meraki})
+
+        if result.errors:
+            result.unchanged = 0
+            return []
+        return inserts
+
+    # Writes the pairs returned by check_mapping. The caller is responsible
+    # for committing.
+    def insert_mapping(self, db_session, inserts, result):
+        for batch in batches(inserts, self.batch_size):
+            db_session.bulk_insert_mappings(models.Mapping, batch)
+
+        result.inserted = len(inserts)
+
+    # Adds the (line, catalyst, meraki) pairs that aren't already mapped.
+    # Every pair is validated before anything is written. The caller is
+    # responsible for committing.
+    def apply_mapping(self, db_session, pairs, result, switch_ids=None):
+        inserts = self.check_mapping(db_session, pairs, result, switch_ids)
+        if result.errors:
+            return
+
+        self.insert_mapping(db_session, inserts, result)
@@ -0,0 +1,235 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+# Usage:
+#   python ingest.py [WORKBOOK] [--force] [--skip-invalid-mapping]
+#
+# Loads the switch and mapping tables straight from the Catalyst/Meraki
+# workbook. Re-running it on an unchanged workbook does nothing.
+
+import argparse
+import datetime
+import hashlib
+import os
+
+import xlrd
+from sqlalchemy.exc import SQLAlchemyError
+
+import catalog
+import migrations
+import models
+from importing import ImportResult, Importer
+
+DEFAULT_WORKBOOK = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "tools", "Catalyst_Meraki_Mapping.xlsm")
+
+SWITCH_SHEETS = ["Catalyst", "Meraki"]
+MAPPING_SHEET = "Mapping"
+
+# The switch sheets have three header rows
+SWITCH_FIRST_ROW = 3
+
+# Columns of the Catalyst and Meraki sheets, in order
+SWITCH_COLUMNS = [
+    "id", "platform", "model", "modular", "network_module", "tier", "dl_ge",
+    "dl_ge_poe", "dl_ge_poep", "dl_ge_upoe", "dl_ge_upoep", "dl_ge_sfp",
+    "dl_2ge_upoe", "dl_mgig_poep", "dl_mgig_upoe", "dl_10ge", "dl_10ge_sfpp",
+    "dl_25ge_sfp28", "dl_40ge_qsfpp", "dl_100ge_qsfp28", "ul_ge_sfp",
+    "ul_mgig", "ul_10ge_sfpp", "ul_25ge_sfp28", "ul_40ge_qsfpp",
+    "ul_100ge_qsfp28", "poe_power", "switching_capacity", "stackable",
+    "mac_entry", "vlan", "note"
+]
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cell_text(cell):
+    # Numbers come out of xlrd as floats, e.g. 48.0
+    if cell.ctype == xlrd.XL_CELL_NUMBER and cell.value == int(cell.value):
+        return str(int(cell.value))
+    return str(cell.value).strip()
+
+
+def sheet_value(name, text):
+    if text == "":
+        return None
+    if name == "modular":
+        return text.lower() == "modular"
+    if name == "stackable":
+        return text.lower() in ("y", "yes", "true")
+    return text
+
+
+def read_switches(book, result):
+    fields = models.SWITCH_FIELDS_BY_NAME
+    header = list(SWITCH_COLUMNS)
+
+    records = []
+    seen = set()
+    for sheet_name in SWITCH_SHEETS:
+        sheet = book.sheet_by_name(sheet_name)
+        for row_index in range(SWITCH_FIRST_ROW, sheet.nrows):
+            cells = [cell_text(cell) for cell in sheet.row(row_index)]
+            # Rows past the end of the table are blank
+            if not cells or not cells[0]:
+                continue
+
+            record = {}
+            for name, text in zip(SWITCH_COLUMNS, cells):
+                try:
+                    record[name] = fields[name].coerce(sheet_value(name, text))
+                except ValueError as e:
+                    result.errors.append(
+                        f"{sheet_name} row {row_index + 1}, {name}: {e}.")
+                    record[name] = None
+
+            id = record["id"]
+            if id.lower() in seen:
+                result.errors.append(
+                    f"{sheet_name} row {row_index + 1}, {id} appears twice.")
+                continue
+            seen.add(id.lower())
+            records.append(record)
+
+    return header, records
+
+
+def read_mapping(book, result):
+    sheet = book.sheet_by_name(MAPPING_SHEET)
+
+    pairs = []
+    # The first row is the header
+    for row_index in range(1, sheet.nrows):
+        cells = [cell_text(cell) for cell in sheet.row(row_index)[:3]]
+        if len(cells) < 3 or not (cells[1] or cells[2]):
+            continue
+        pairs.append((row_index + 1, cells[1], cells[2]))
+
+    return pairs
+
+
+def ingest(path=DEFAULT_WORKBOOK,
+           force=False,
+           skip_invalid_mapping=False,
+           importer=None):
+    importer = importer or Importer()
+    source = os.path.basename(path)
+    digest = file_digest(path)
+
+    switch_result = ImportResult("switches")
+    mapping_result = ImportResult("mapping")
+
+    try:
+        db_session = models.session_factory()
+
+        # Nothing to do if this exact workbook was the last one loaded
+        state = db_session.query(models.IngestState).get(source)
+        if state and state.digest == digest and not force:
+            print(f"{source} is unchanged since {state.loaded_at}, skipping.")
+            return switch_result, mapping_result
+
+        book = xlrd.open_workbook(path, on_demand=True)
+        try:
+            header, records = read_switches(book, switch_result)
+            pairs = read_mapping(book, mapping_result)
+        finally:
+            book.release_resources()
+
+        # Mapping has to point at switches on the switch sheets
+        switch_ids = {record["id"].lower() for record in records}
+        if skip_invalid_mapping:
+            valid_pairs = []
+            for line, catalyst, meraki in pairs:
+                if catalyst.lower() in switch_ids and meraki.lower(
+                ) in switch_ids:
+                    valid_pairs.append((line, catalyst, meraki))
+                else:
+                    print(f"Skipping mapping on row {line}: {catalyst} <=> {meraki}")
+            pairs = valid_pairs
+
+        # Validate the mapping before any of the workbook is written
+        mapping_inserts = importer.check_mapping(db_session,
+                                                 pairs,
+                                                 mapping_result,
+                                                 switch_ids=switch_ids)
+        if switch_result.errors or mapping_result.errors:
+            switch_result.discard()
+            mapping_result.discard()
+            return switch_result, mapping_result
+
+        importer.apply_switches(db_session, header, records, switch_result)
+        if switch_result.errors:
+            db_session.rollback()
+            switch_result.discard()
+            mapping_result.discard()
+            return switch_result, mapping_result
+        importer.insert_mapping(db_session, mapping_inserts, mapping_result)
+
+        # Remember what was loaded so the next run can skip it
+        if not state:
+            state = models.IngestState(source=source)
+            db_session.add(state)
+        state.digest = digest
+        state.loaded_at = datetime.datetime.utcnow()
+
+        db_session.commit()
+
+        if switch_result.inserted or switch_result.updated:
+            catalog.switch_index.invalidate()
+        if mapping_result.inserted:
+            catalog.mapping_graph.invalidate()
+
+        return switch_result, mapping_result
+
+    except SQLAlchemyError as e:
+        # Roll the whole ingest back so the catalog is left untouched
+        db_session.rollback()
+        switch_result.discard()
+        mapping_result.discard()
+        switch_result.errors.append(f"The database rejected the ingest: {e}")
+        return switch_result, mapping_result
+
+    finally:
+        db_session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load the switch catalog from the mapping workbook.")
+    parser.add_argument("workbook", nargs="?", default=DEFAULT_WORKBOOK)
+    parser.add_argument("--force",
+                        action="store_true",
+                        help="Load the workbook even if it hasn't changed")
+    parser.add_argument(
+        "--skip-invalid-mapping",
+        action="store_true",
+        help="Skip mapping rows that refer to switches not in the workbook")
+    args = parser.parse_args()
+
+    # The ingest state table comes from the migrations
+    migrations.upgrade()
+
+    for result in ingest(args.workbook,
+                         force=args.force,
+                         skip_invalid_mapping=args.skip_invalid_mapping):
+        print(str(result).replace("**", ""))
@@ -0,0 +1,95 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import catalog
+
+# Words that can surround a model number without changing what is being asked
+FILLER_WORDS = {
+    "a", "an", "and", "can", "convert", "conversion", "equivalent",
+    "equivalents", "find", "for", "give", "i", "in", "into", "is", "me",
+    "model", "module", "need", "network", "nm", "of", "please", "replace",
+    "replacement", "show", "switch", "the", "to", "what", "what's", "whats",
+    "with", "you"
+}
+
+PLATFORMS = {
+    "catalyst": "Catalyst",
+    "cisco": "Catalyst",
+    "meraki": "Meraki",
+}
+
+PUNCTUATION = "?!.,;:'\"()"
+
+
+class IntentParser():
+    def __init__(self, switch_index=None):
+        super().__init__()
+        self.switch_index = switch_index or catalog.switch_index
+
+    # Extracts the same parameters the DialogFlow intent would, but only
+    # when every word in the message is accounted for. Returns None when
+    # unsure so that DialogFlow can have a go at it instead.
+    def parse(self, text):
+        if not text:
+            return None
+
+        model = None
+        network_module = None
+        platform = None
+
+        for word in text.split():
+            token = word.strip(PUNCTUATION)
+            if not token:
+                continue
+            lowered = token.lower()
+
+            if lowered in PLATFORMS:
+                platform = PLATFORMS[lowered]
+                continue
+            if lowered in FILLER_WORDS:
+                continue
+
+            found_model = self.switch_index.lookup_model(token)
+            if found_model:
+                found_model, found_network_module = found_model
+                # Two different model numbers is not a simple conversion
+                if model and model != found_model:
+                    return None
+                model = found_model
+                if found_network_module:
+                    network_module = found_network_module
+                continue
+
+            found_network_module = self.switch_index.lookup_network_module(
+                token)
+            if found_network_module:
+                if network_module and network_module != found_network_module:
+                    return None
+                network_module = found_network_module
+                continue
+
+            # Anything we don't recognise means the message needs real NLP
+            return None
+
+        if not model:
+            return None
+
+        return {
+            "Model": model,
+            "Network_Module": network_module or "",
+            "Platform": platform or "",
+        }
@@ -0,0 +1,167 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from cache import TTLCache
+
+
+class TokenBucket():
+    # Holds up to burst tokens, refilled at rate tokens a second
+    def __init__(self, rate, burst):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class RateLimiter():
+    # A token bucket per key, e.g. per person or per room. Set per_minute
+    # to 0 to turn the limit off.
+    def __init__(self, per_minute, burst, maxsize=10000):
+        super().__init__()
+        self.rate = per_minute / 60
+        self.burst = burst
+        self._lock = threading.Lock()
+        # An idle bucket is full again once this long has passed, so
+        # dropping it then changes nothing
+        ttl = burst / self.rate if self.rate else 0
+        self._buckets = TTLCache(maxsize=maxsize, ttl=ttl)
+
+        self.allowed = 0
+        self.limited = 0
+
+    def allow(self, key):
+        if not self.rate or not key:
+            return True
+
+        with self._lock:
+            bucket = self._buckets.get(key, None)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst)
+            allowed = bucket.take()
+            # Setting it again also pushes back when it expires
+            self._buckets.set(key, bucket)
+
+            if allowed:
+                self.allowed += 1
+            else:
+                self.limited += 1
+            return allowed
+
+    def stats(self):
+        return {
+            "keys": len(self._buckets),
+            "allowed": self.allowed,
+            "limited": self.limited
+        }
+
+
+class ConcurrencyLimiter():
+    # Caps how much work runs at once, waiting up to timeout seconds for a
+    # free slot before giving up
+    def __init__(self, limit, timeout=5):
+        super().__init__()
+        self.limit = limit
+        self.timeout = timeout
+        self._semaphore = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    @contextmanager
+    def slot(self):
+        # Yields whether a slot was free in time
+        with self._lock:
+            self.waiting += 1
+        acquired = self._semaphore.acquire(timeout=self.timeout)
+        with self._lock:
+            self.waiting -= 1
+            if acquired:
+                self.active += 1
+                self.admitted += 1
+            else:
+                self.rejected += 1
+
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                with self._lock:
+                    self.active -= 1
+                self._semaphore.release()
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected
+        }
+
+
+class AdmissionControl():
+    # Sheds work early when one person or room sends too much, and keeps
+    # the work that touches the database from piling up
+    def __init__(self,
+                 person_per_minute=20,
+                 person_burst=10,
+                 room_per_minute=60,
+                 room_burst=20,
+                 db_concurrency=10,
+                 db_timeout=5,
+                 notice_interval=60):
+        super().__init__()
+        self.people = RateLimiter(person_per_minute, person_burst)
+        self.rooms = RateLimiter(room_per_minute, room_burst)
+        self.db = ConcurrencyLimiter(db_concurrency, db_timeout)
+        # Who has been told they're being limited, so that the notice
+        # itself isn't sent on every message
+        self._notices = TTLCache(maxsize=10000, ttl=notice_interval)
+
+    def allow(self, person_id, room_id):
+        # The person goes first so that someone flooding a room uses up
+        # their own tokens rather than the room's
+        return self.people.allow(person_id) and self.rooms.allow(room_id)
+
+    def should_notify(self, key):
+        return self._notices.add(key, True)
+
+    def stats(self):
+        stats = {}
+        for name, limiter in (("person", self.people), ("room", self.rooms),
+                              ("db", self.db)):
+            for stat, value in limiter.stats().items():
+                stats[(name, stat)] = value
+        return stats
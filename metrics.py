@@ -0,0 +1,295 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import functools
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+# Seconds, from an in-memory lookup up to a slow Dialogflow round trip
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+# Pulls the verb and table out of a statement, e.g. ("SELECT", "switch")
+SQL_PATTERN = re.compile(
+    r"^\s*(\w+)\b.*?\b(?:FROM|INTO|UPDATE|TABLE)\s+[`\"]?(\w+)",
+    re.IGNORECASE | re.DOTALL)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n",
+                                                    "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram():
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__()
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"), )
+        self._lock = threading.Lock()
+        # Label values => [bucket counts..., sum]
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values, None)
+            if series is None:
+                series = [0] * len(self.buckets) + [0.0]
+                self._series[label_values] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram"
+        ]
+        with self._lock:
+            series = {key: list(value) for key, value in self._series.items()}
+
+        for label_values, counts in sorted(series.items()):
+            total = 0
+            for bound, count in zip(self.buckets, counts):
+                total += count
+                labels = _format_labels(self.labels, label_values,
+                                        f'le="{_format_number(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {total}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {counts[-1]}")
+            lines.append(f"{self.name}_count{labels} {total}")
+        return lines
+
+
+class Counter():
+    def __init__(self, name, description, labels=()):
+        super().__init__()
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values,
+                                                          0) + amount
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} counter"
+        ]
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}{labels} {value}")
+        return lines
+
+
+class Gauge():
+    # Read from a callback when scraped, for stats kept elsewhere. The
+    # callback returns a number, or a dict of label values to numbers.
+    def __init__(self, name, description, callback, labels=()):
+        super().__init__()
+        self.name = name
+        self.description = description
+        self.callback = callback
+        self.labels = tuple(labels)
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} gauge"
+        ]
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in sorted(values.items()):
+            if type(label_values) != tuple:
+                label_values = (label_values, )
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}{labels} {_format_number(value)}")
+        return lines
+
+
+class Registry():
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, metric):
+        with self._lock:
+            # Registering the same name again replaces the old one
+            self._metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, description, labels, buckets))
+
+    def counter(self, name, description, labels=()):
+        return self._register(Counter(name, description, labels))
+
+    def gauge(self, name, description, callback, labels=()):
+        return self._register(Gauge(name, description, callback, labels))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                # A broken stats callback shouldn't take the endpoint down
+                continue
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_duration = registry.histogram(
+    "meercat_http_request_duration_seconds",
+    "Time taken to answer each HTTP route", ["route", "method", "status"])
+dependency_duration = registry.histogram(
+    "meercat_dependency_duration_seconds",
+    "Time spent waiting on Dialogflow, Webex and the database",
+    ["dependency", "operation"])
+dependency_errors = registry.counter("meercat_dependency_errors_total",
+                                     "Calls to a dependency that failed",
+                                     ["dependency", "operation"])
+span_duration = registry.histogram(
+    "meercat_span_duration_seconds",
+    "Time taken by the conversion and editing steps, including their queries",
+    ["span"])
+
+
+def dependency(name, operation=None):
+    # Decorator that times each call as a call to an external dependency
+    def decorator(fn):
+        label = operation or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                dependency_errors.inc(name, label)
+                raise
+            finally:
+                dependency_duration.observe(time.perf_counter() - started,
+                                            name, label)
+
+        return wrapper
+
+    return decorator
+
+
+def span(name=None):
+    # Decorator that times each call of a method, e.g. Editor.list_all_switches
+    def decorator(fn):
+        label = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span_duration.time(label):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class TracedAPI():
+    # Wraps an API client so every method call on it, e.g.
+    # api.messages.create, is timed as a dependency call
+    def __init__(self, api, name="webex", prefix=""):
+        super().__init__()
+        self._api = api
+        self._name = name
+        self._prefix = prefix
+
+    def __getattr__(self, attr):
+        value = getattr(self._api, attr)
+        if isinstance(value, (str, bytes, int, float, bool, type(None), dict,
+                              list, tuple, set)):
+            return value
+        if callable(value):
+            return dependency(self._name, self._prefix + attr)(value)
+        return TracedAPI(value, self._name, f"{self._prefix}{attr}.")
+
+
+def instrument_engine(engine, name="database"):
+    # Times every statement the engine runs, labelled by verb and table
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(connection, cursor, statement, parameters,
+                              context, executemany):
+        connection.info.setdefault("query_started", []).append(
+            time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(connection, cursor, statement, parameters,
+                             context, executemany):
+        started = connection.info["query_started"].pop()
+        dependency_duration.observe(time.perf_counter() - started, name,
+                                    statement_label(statement))
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        started = context.connection.info.get("query_started", None)
+        if started:
+            started.pop()
+        dependency_errors.inc(name, statement_label(context.statement or ""))
+
+
+def statement_label(statement):
+    match = SQL_PATTERN.match(statement)
+    if not match:
+        return statement.split(" ", 1)[0].upper() or "UNKNOWN"
+    return f"{match.group(1).upper()} {match.group(2).lower()}"
@@ -0,0 +1,210 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+# Usage:
+#   python migrations.py status    Shows which migrations have been applied
+#   python migrations.py upgrade   Applies any outstanding migrations
+#   python migrations.py explain   Prints the query plans for the hot queries
+
+import argparse
+import datetime
+
+import sqlalchemy as db
+from sqlalchemy import func, or_
+
+import models
+
+
+def _create_indexes(connection, table, names):
+    existing = {
+        index["name"]
+        for index in db.inspect(connection).get_indexes(table.name)
+    }
+    for index in table.indexes:
+        if index.name in names and index.name not in existing:
+            print(f"Creating index {index.name} on {table.name}")
+            index.create(connection)
+
+
+def index_switch_lookups(connection):
+    _create_indexes(connection, models.Switch.__table__, {
+        "ix_switch_model",
+        "ix_switch_network_module",
+        "ix_switch_platform",
+    })
+
+
+def index_mapping_lookups(connection):
+    _create_indexes(connection, models.Mapping.__table__, {
+        "ix_mapping_catalyst",
+        "ix_mapping_meraki",
+    })
+
+
+def unique_mapping_pairs(connection):
+    mapping = models.Mapping.__table__
+
+    # Remove duplicate pairs first, keeping the oldest row of each
+    keep = db.select([func.min(mapping.c.id)]) \
+             .group_by(mapping.c.catalyst, mapping.c.meraki)
+    keep_ids = [row[0] for row in connection.execute(keep)]
+    if keep_ids:
+        deleted = connection.execute(
+            mapping.delete().where(~mapping.c.id.in_(keep_ids))).rowcount
+        if deleted:
+            print(f"Removed {deleted} duplicate mapping rows")
+
+    _create_indexes(connection, mapping, {"uq_mapping_catalyst_meraki"})
+
+
+def create_ingest_state(connection):
+    models.IngestState.__table__.create(connection, checkfirst=True)
+
+
+def add_switch_ge_upoe(connection):
+    # tools/create_table.sql already has the column, tables created from
+    # the models before it was added don't
+    switch = models.Switch.__table__
+    existing = {
+        column["name"]
+        for column in db.inspect(connection).get_columns(switch.name)
+    }
+    if "dl_ge_upoe" not in existing:
+        print(f"Adding column dl_ge_upoe to {switch.name}")
+        connection.execute(
+            f"ALTER TABLE {switch.name} ADD COLUMN dl_ge_upoe INTEGER")
+
+
+# Append new migrations to the end of this list, never reorder or remove them
+MIGRATIONS = [
+    (1, "Index switch model, network module and platform",
+     index_switch_lookups),
+    (2, "Index mapping catalyst and meraki", index_mapping_lookups),
+    (3, "Unique catalyst and meraki mapping pairs", unique_mapping_pairs),
+    (4, "Track workbook ingests", create_ingest_state),
+    (5, "Add 1GE-UPoE downlinks to switch", add_switch_ge_upoe),
+]
+
+
+def get_applied_versions(engine):
+    models.SchemaVersion.__table__.create(engine, checkfirst=True)
+    with engine.connect() as connection:
+        rows = connection.execute(
+            db.select([models.SchemaVersion.__table__.c.version]))
+        return {row[0] for row in rows}
+
+
+def upgrade(engine=None):
+    engine = engine or models.get_engine()
+    applied = get_applied_versions(engine)
+
+    for version, description, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+
+        print(f"Applying migration {version}: {description}")
+        with engine.begin() as connection:
+            migrate(connection)
+            connection.execute(models.SchemaVersion.__table__.insert().values(
+                version=version,
+                description=description,
+                applied_at=datetime.datetime.utcnow()))
+
+    return len(MIGRATIONS) - len(applied)
+
+
+def status(engine=None):
+    engine = engine or models.get_engine()
+    applied = get_applied_versions(engine)
+
+    for version, description, migrate in MIGRATIONS:
+        state = "applied" if version in applied else "pending"
+        print(f"{version:>3} [{state}] {description}")
+
+
+# The queries conversion and editing run most often
+def hot_queries(db_session):
+    example_switch = "C9300-48P-A"
+    example_module = "C9300-NM-8X"
+    example_mapping = "MS355-48X2-HW"
+
+    return {
+        "switch by model":
+        db_session.query(models.Switch).filter(
+            models.Switch.model.like(example_switch)),
+        "switch by model and network module":
+        db_session.query(models.Switch).filter(
+            models.Switch.model.like(example_switch)).filter(
+                models.Switch.network_module.like(example_module)),
+        "switch by platform":
+        db_session.query(models.Switch).filter(
+            models.Switch.platform == "C9300"),
+        "mapping by catalyst":
+        db_session.query(models.Mapping).filter(
+            models.Mapping.catalyst.like(example_switch)),
+        "mapping by meraki":
+        db_session.query(models.Mapping).filter(
+            models.Mapping.meraki.like(example_mapping)),
+        "mapping pair":
+        db_session.query(models.Mapping).filter(
+            or_(models.Mapping.meraki.like(example_mapping),
+                models.Mapping.catalyst.like(example_mapping))).filter(
+                    or_(models.Mapping.meraki.like(example_switch),
+                        models.Mapping.catalyst.like(example_switch))),
+        "user by id":
+        db_session.query(models.User).filter(models.User.id == "admin"),
+    }
+
+
+def explain(engine=None):
+    engine = engine or models.get_engine()
+    if engine.dialect.name == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN"
+    else:
+        prefix = "EXPLAIN"
+
+    db_session = models.session_factory(bind=engine)
+    try:
+        for name, query in hot_queries(db_session).items():
+            sql = str(
+                query.statement.compile(
+                    dialect=engine.dialect,
+                    compile_kwargs={"literal_binds": True}))
+            print(f"-- {name}\n{sql}")
+            for row in engine.execute(f"{prefix} {sql}"):
+                print("   ", tuple(row))
+            print()
+    finally:
+        db_session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Manage the meercat database schema.")
+    parser.add_argument("command",
+                        choices=["status", "upgrade", "explain"],
+                        nargs="?",
+                        default="status")
+    args = parser.parse_args()
+
+    if args.command == "upgrade":
+        count = upgrade()
+        print(f"Applied {count} migration(s).")
+    elif args.command == "explain":
+        explain()
+    else:
+        status()
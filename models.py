@@ -16,15 +16,137 @@ or implied.
 """
 
 import os
+import threading
+import time
 
 import sqlalchemy as db
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String
+from flask import _app_ctx_stack
+from sqlalchemy import (Boolean, Column, DateTime, ForeignKey, Index, Integer,
+                        String)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session as OrmSession
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+
+class TimedQueuePool(QueuePool):
+    # A QueuePool that records how long callers wait for a connection
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._wait_lock = threading.Lock()
+        self.wait_count = 0
+        self.wait_seconds = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - start
+            with self._wait_lock:
+                self.wait_count += 1
+                self.wait_seconds += waited
+                self.wait_max = max(self.wait_max, waited)
+
+
+def engine_options(url):
+    # SQLite doesn't use a connection pool we can size
+    if not url or url.startswith("sqlite"):
+        return {}
+
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", 30)),
+        # MySQL drops idle connections, so recycle them before it does
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 280)),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+    }
+
+
+def pool_stats():
+    # Nothing to report until something has used the database
+    if _engine is None:
+        return {}
+    pool = _engine.pool
+    if not isinstance(pool, QueuePool):
+        return {}
+
+    stats = {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(0, pool.overflow()),
+    }
+    if isinstance(pool, TimedQueuePool):
+        stats["wait_count"] = pool.wait_count
+        stats["wait_seconds"] = pool.wait_seconds
+        stats["wait_max_seconds"] = pool.wait_max
+    return stats
+
+
+def _session_scope():
+    # Share one session per Flask app context, or per thread outside of one
+    context = _app_ctx_stack.top
+    if context is not None:
+        return ("app", id(context))
+    return ("thread", threading.get_ident())
+
+
+def release_session(db_session):
+    # Request scoped sessions are closed when the app context tears down
+    if _app_ctx_stack.top is None:
+        db_session.close()
+
 
 database_url = os.getenv('DATABASE_URL')
-db_engine = db.create_engine(database_url)
-Session = sessionmaker(bind=db_engine)
+
+# The engine is created the first time the database is used, so importing
+# the models doesn't load a database driver
+_engine = None
+_engine_lock = threading.Lock()
+_engine_hooks = []
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = db.create_engine(database_url,
+                                          **engine_options(database_url))
+                for hook in _engine_hooks:
+                    hook(engine)
+                session_factory.configure(bind=engine)
+                _engine = engine
+    return _engine
+
+
+def on_engine_created(hook):
+    # Runs hook on the engine once it exists, e.g. to instrument it. A hook
+    # is only ever run once.
+    with _engine_lock:
+        if hook in _engine_hooks:
+            return
+        _engine_hooks.append(hook)
+        engine = _engine
+    if engine is not None:
+        hook(engine)
+
+
+class LazySession(OrmSession):
+    # Sessions made before the engine exists create it when first used
+    def get_bind(self, mapper=None, clause=None):
+        if self.bind is None:
+            self.bind = get_engine()
+        return super().get_bind(mapper=mapper, clause=clause)
+
+
+# Use session_factory directly for sessions that outlive a request
+session_factory = sessionmaker(class_=LazySession)
+Session = scoped_session(session_factory, scopefunc=_session_scope)
 Base = declarative_base(name='Model')
 
 
@@ -41,29 +163,50 @@ class User(Base):
         return self.privilege.lower() == "editor" or self.is_admin()
 
 
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+
+    version = Column(Integer, primary_key=True)
+    description = Column(String(255))
+    applied_at = Column(DateTime)
+
+
+class IngestState(Base):
+    __tablename__ = 'ingest_state'
+
+    source = Column(String(255), primary_key=True)
+    digest = Column(String(64))
+    loaded_at = Column(DateTime)
+
+
 class Mapping(Base):
     __tablename__ = 'mapping'
+    __table_args__ = (Index('uq_mapping_catalyst_meraki',
+                            'catalyst',
+                            'meraki',
+                            unique=True), )
 
     id = Column(Integer, primary_key=True)
-    catalyst = Column(String, ForeignKey('switch.id'))
-    meraki = Column(String, ForeignKey('switch.id'))
+    catalyst = Column(String, ForeignKey('switch.id'), index=True)
+    meraki = Column(String, ForeignKey('switch.id'), index=True)
 
 
 class Switch(Base):
     __tablename__ = 'switch'
 
     id = Column(String, primary_key=True)
-    platform = Column(String)
-    model = Column(String)
-    modular = Column(Boolean)
+    platform = Column(String, nullable=False, index=True)
+    model = Column(String, nullable=False, index=True)
+    modular = Column(Boolean, nullable=False)
 
     stackable = Column(Boolean)
-    network_module = Column(String)
+    network_module = Column(String, index=True)
     tier = Column(String)
 
     dl_ge = Column(Integer)
     dl_ge_poe = Column(Integer)
     dl_ge_poep = Column(Integer)
+    dl_ge_upoe = Column(Integer)
     dl_ge_upoep = Column(Integer)
     dl_ge_sfp = Column(Integer)
     dl_2ge_upoe = Column(Integer)
@@ -99,6 +242,7 @@ class Switch(Base):
         "dl_ge": "1GE DL",
         "dl_ge_poe": "1GE-PoE DL",
         "dl_ge_poep": "1GE-PoE+ DL",
+        "dl_ge_upoe": "1GE-UPoE DL",
         "dl_ge_upoep": "1GE-UPoE+ DL",
         "dl_ge_sfp": "1G-SFP DL",
         "dl_2ge_upoe": "2.5GE-UPoE DL",
@@ -130,3 +274,88 @@ class Switch(Base):
                 text += f"{attr}: {value}\n"
 
         return text
+
+
+TRUE_VALUES = ("true", "1", "yes", "y")
+FALSE_VALUES = ("false", "0", "no", "n")
+
+
+def to_bool(value):
+    if value.lower() in TRUE_VALUES:
+        return True
+    if value.lower() in FALSE_VALUES:
+        return False
+    raise ValueError(f"'{value}' is not a valid true/false value")
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"'{value}' is not a valid whole number")
+
+
+def to_str(value):
+    return value
+
+
+class Field():
+    # What the forms, importer and exporter need to know about a column,
+    # worked out once rather than reflected on every request
+    def __init__(self, column, pretty_name=None):
+        super().__init__()
+        self.name = column.name
+        self.column = column
+        self.pretty_name = pretty_name or column.name
+        self.nullable = column.nullable
+
+        if isinstance(column.type, Boolean):
+            self.type = bool
+            self.coercer = to_bool
+        elif isinstance(column.type, Integer):
+            self.type = int
+            self.coercer = to_int
+        else:
+            self.type = str
+            self.coercer = to_str
+
+    def coerce(self, value):
+        # Form and CSV values are text, empty means null
+        if type(value) == str:
+            value = value.strip()
+            if value != "":
+                return self.coercer(value)
+            value = None
+
+        if value is None and not self.nullable:
+            raise ValueError("a value is required")
+        return value
+
+    def format(self, value):
+        # The reverse of coerce, for writing CSVs
+        if value is None:
+            return ""
+        if self.type == bool:
+            return "true" if value else "false"
+        return value
+
+
+_descriptors = {}
+
+
+def describe(model):
+    # Returns the fields of a model in column order
+    if model not in _descriptors:
+        pretty_names = getattr(model, "_name_mapping", {})
+        _descriptors[model] = [
+            Field(column, pretty_names.get(column.name, None))
+            for column in model.__table__.columns
+        ]
+    return _descriptors[model]
+
+
+SWITCH_FIELDS = describe(Switch)
+SWITCH_FIELDS_BY_NAME = {field.name: field for field in SWITCH_FIELDS}
+REQUIRED_SWITCH_FIELDS = [
+    field.name for field in SWITCH_FIELDS if not field.nullable
+]
@@ -19,7 +19,8 @@ or implied.
 RESPONSE_HELP = "**Send your model number and I will attempt to convert it into an equivalent Meraki model.**\n\n" + \
                 "I understand natural language so you can type a question to me as well!\n\n" + \
                 "*Available commands:*  \n" + \
-                "**/list [switches/mapping/users] [FILTER]**: Lists all switches or mappings in the database. Optionally you can provide a filter.  \n" + \
+                "**/convert [MODELS]**: Converts a list of models at once, one per line or separated by commas. Add the network module after a modular switch, e.g. C9300-48P-A C9300-NM-8X. You can also post a CSV or Excel bill of materials to have it converted.  \n" + \
+                "**/list [switches/mapping/users] [FILTER] [page N]**: Lists all switches or mappings in the database. Optionally you can provide a filter or ask for one page.  \n" + \
                 "**/edit [KEY]**: Edits the switch matching the key provided (keys returned from the list command, in the format MODEL+NETWORK_MODULE).  \n" + \
                 "**/add-switch**: Adds a new switch to the database.  \n" + \
                 "**/remove-switch [PK]**: Removes a switch from the database.  \n" + \
@@ -28,15 +29,19 @@ RESPONSE_HELP = "**Send your model number and I will attempt to convert it into
                 "**/allow [USER_ID]**: Allows a user to edit the database.  \n" + \
                 "**/disallow [USER_ID]**: Disallows a user from editing the database.  \n" + \
                 "**/request [MESSAGE]**: Requests editing access. Please supply a message with details.  \n" + \
-                "**/export**: Exports a CSV copy of the current database for bulk editing.  \n" + \
-                "**/import**: Imports a CSV of the current database for bulk editing."
+                "**/export [switches/mapping/users]**: Exports a CSV copy of the current database for bulk editing. Exports a zip of every table if none is given.  \n" + \
+                "**/import**: Imports an attached CSV of the switches or mapping table for bulk editing. Only rows that have changed are written."
 
 RESPONSE_HELP_RESTRICTED = "**Send your model number and I will attempt to convert it into an equivalent Meraki model.**\n\n" + \
                 "I understand natural language so you can type a question to me as well!\n\n" + \
                 "*Available commands:*  \n" + \
-                "**/list [switches/mapping] [FILTER]**: Lists all switches or mappings in the database. Optionally you can provide a filter.  \n" + \
+                "**/convert [MODELS]**: Converts a list of models at once, one per line or separated by commas. Add the network module after a modular switch, e.g. C9300-48P-A C9300-NM-8X. You can also post a CSV or Excel bill of materials to have it converted.  \n" + \
+                "**/list [switches/mapping] [FILTER] [page N]**: Lists all switches or mappings in the database. Optionally you can provide a filter or ask for one page.  \n" + \
                 "**/request [MESSAGE]**: Requests editing access. Please supply a message with details.  \n"
 
 RESPONSE_NOT_IMPLEMENTED = "This feature is not yet implemented."
+RESPONSE_IMPORT_NO_FILE = "Please attach a CSV exported with /export to the /import message."
 RESPONSE_NO_PERMISSION = "Sorry, you don't have permission to do that."
 RESPONSE_COMMAND_NOT_RECOGNISED = "Unrecognised command!\n\nSee /help for a list of available commands."
+RESPONSE_RATE_LIMITED = "You're sending messages faster than I can keep up with - please wait a moment and try again."
+RESPONSE_BUSY = "I'm busy right now - please try again in a moment."
@@ -0,0 +1,178 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import heapq
+import threading
+from collections import Counter
+from itertools import chain
+
+import catalog
+import metrics
+
+# Only this many of the best trigram matches get an edit distance worked out
+MAX_CANDIDATES = 10
+
+# Suggestions scoring below this are more noise than help
+MIN_SCORE = 0.5
+
+
+def normalise(text):
+    return "".join(text.split()).lower()
+
+
+def trigrams(text):
+    # Padded so the start and end of a model count for more, e.g. "  c"
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def damerau_levenshtein(a, b, max_distance=None):
+    # Edit distance counting a swap of two neighbouring characters as one
+    # edit (the optimal string alignment variant). Gives up early with
+    # max_distance + 1 once the distance is sure to be larger.
+    if a == b:
+        return 0
+    if max_distance is None:
+        max_distance = max(len(a), len(b))
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    # Only cells within max_distance of the diagonal can lead to a result,
+    # everything outside that band is treated as too far away
+    too_far = max_distance + 1
+    before = None
+    previous = [j if j <= max_distance else too_far for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        char = a[i - 1]
+        current = [too_far] * (len(b) + 1)
+        if i <= max_distance:
+            current[0] = i
+        row_min = current[0]
+
+        # Plain comparisons rather than min() as this is the hot loop
+        for j in range(max(1, i - max_distance),
+                       min(len(b), i + max_distance) + 1):
+            value = previous[j - 1] if char == b[j - 1] else previous[j - 1] + 1
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if before is not None and j > 1 and char == b[j - 2] and a[
+                    i - 2] == b[j - 1] and before[j - 2] + 1 < value:
+                value = before[j - 2] + 1
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > max_distance:
+            return too_far
+        before, previous = previous, current
+
+    if previous[-1] > max_distance:
+        return too_far
+    return previous[-1]
+
+
+def similarity(a, b):
+    # 1.0 for identical strings down to 0.0 for nothing in common
+    longest = max(len(a), len(b))
+    if not longest:
+        return 1.0
+    return 1.0 - damerau_levenshtein(a, b) / longest
+
+
+class SimilarityIndex():
+    # Trigram index over every switch ID and model in the catalog, used to
+    # rank near misses and typos by edit distance
+    def __init__(self, switch_index=None):
+        super().__init__()
+        self.switch_index = switch_index or catalog.switch_index
+        self._lock = threading.Lock()
+        self._revision = None
+        # Normalised term => the ID or model as it is in the catalog
+        self._terms = {}
+        # Trigram => normalised terms containing it
+        self._postings = {}
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._revision == self.switch_index.revision:
+                return self._terms, self._postings
+
+            switches = self.switch_index.all()
+
+            terms = {}
+            for switch in switches:
+                for value in (switch.model, switch.id):
+                    if value:
+                        terms.setdefault(normalise(value), value)
+
+            postings = {}
+            for term in terms:
+                for trigram in trigrams(term):
+                    postings.setdefault(trigram, []).append(term)
+
+            self._terms = terms
+            self._postings = postings
+            self._revision = self.switch_index.revision
+            return terms, postings
+
+    @metrics.span()
+    def search(self, text, k=5, min_score=MIN_SCORE):
+        # Returns up to k (ID or model, score) pairs, best first
+        query = normalise(text)
+        if not query:
+            return []
+        terms, postings = self._ensure_loaded()
+
+        if query in terms:
+            return [(terms[query], 1.0)]
+
+        # Shortlist the terms sharing the most trigrams with the query
+        shared = Counter(
+            chain.from_iterable(
+                postings.get(trigram, ()) for trigram in trigrams(query)))
+        shortlist = heapq.nlargest(
+            MAX_CANDIDATES,
+            shared.items(),
+            key=lambda item: item[1] / (len(item[0]) + len(query)))
+
+        results = []
+        for term, count in shortlist:
+            longest = max(len(query), len(term))
+            # Only work out distances that could still make the top k
+            floor = min_score
+            if len(results) >= k:
+                floor = max(floor, results[k - 1][1])
+            max_distance = int(longest * (1 - floor))
+            distance = damerau_levenshtein(query, term, max_distance)
+            if distance > max_distance:
+                continue
+            results.append((terms[term], 1.0 - distance / longest))
+            results.sort(key=lambda result: (-result[1], len(result[0]),
+                                             result[0]))
+
+        return results[:k]
+
+    def rank(self, text, switches, key=lambda switch: switch.model):
+        # Orders switches by how close they are to what was asked for
+        query = normalise(text or "")
+        return sorted(switches,
+                      key=lambda switch: -similarity(
+                          query, normalise(key(switch) or "")))
+
+
+similarity_index = SimilarityIndex()
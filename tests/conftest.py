@@ -0,0 +1,62 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "tools"))
+
+# The tests run against a throwaway SQLite copy of the catalog, built the
+# same way as the benchmark's. It has to exist before models is imported.
+directory = tempfile.mkdtemp(prefix="meercat-tests-")
+atexit.register(shutil.rmtree, directory, True)
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'catalog.db')}"
+os.environ.setdefault("WEBEX_TEAMS_ACCESS_TOKEN", "test")
+os.environ.setdefault("DIALOGFLOW_PROJECT_ID", "test")
+
+import benchmark  # noqa: E402
+import migrations  # noqa: E402
+import models  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+benchmark.create_database(os.path.join(directory, "catalog.db"))
+migrations.upgrade()
+
+
+class StatementCounter():
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+@pytest.fixture
+def statements():
+    # Counts the SQL statements run while the test uses it
+    counter = StatementCounter()
+    engine = models.get_engine()
+    event.listen(engine, "before_cursor_execute", counter)
+    yield counter
+    event.remove(engine, "before_cursor_execute", counter)
@@ -0,0 +1,32 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client():
+    return app.create_app(warm=False).test_client()
+
+
+@pytest.mark.parametrize("path", ["/events", "/actions"])
+@pytest.mark.parametrize(
+    "payload", [[], "x", 5, {}, {"data": []}, {"data": {"id": ""}}])
+def test_webhooks_that_are_not_objects_are_rejected(client, path, payload):
+    assert client.post(path, json=payload).status_code == 400
@@ -0,0 +1,43 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import pytest
+
+from batch import AMBIGUOUS, MODULAR_NEEDS_MODULE, BatchConverter, parse_item
+
+
+def test_parse_item_reads_lines_and_objects():
+    assert parse_item("C9300-48P-A C9300-NM-8X") == ("C9300-48P-A",
+                                                     "C9300-NM-8X")
+    assert parse_item({"model": "MS120-8-HW"}) == ("MS120-8-HW", None)
+
+
+@pytest.mark.parametrize("item", [
+    42, {"model": 9300}, {"model": "C9300-48P-A", "network_module": 8},
+    {"model": ["C9300-48P-A"]}
+])
+def test_parse_item_rejects_values_that_are_not_text(item):
+    with pytest.raises(ValueError):
+        parse_item(item)
+
+
+def test_modular_needs_module_only_when_every_match_is_modular():
+    converter = BatchConverter()
+    # Matches the modular C9300-48P-A and -E and the fixed C9300L-48P models
+    assert converter.resolve("C9300-48P", None)["status"] == AMBIGUOUS
+    assert converter.resolve("C9300-48P-A",
+                             None)["status"] == MODULAR_NEEDS_MODULE
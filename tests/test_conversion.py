@@ -0,0 +1,71 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import catalog
+import models
+from conversion import Converter
+
+
+def mapped_switches():
+    # The switches with the fewest and the most equivalents
+    switches = [
+        switch for switch in catalog.switch_index.all()
+        if catalog.mapping_graph.neighbours(switch.id)
+    ]
+    switches.sort(key=lambda switch: len(
+        catalog.mapping_graph.neighbours(switch.id)))
+    return switches[0], switches[-1]
+
+
+def cold_statements(statements, switch):
+    catalog.switch_index.invalidate()
+    catalog.mapping_graph.invalidate()
+    statements.count = 0
+    data = convert(switch)
+    assert data["matched"]
+    assert data["switches"]
+    return statements.count
+
+
+def convert(switch):
+    try:
+        return Converter("test", "test").find_equivalent_switch({
+            "Model": switch.model,
+            "Network_Module": switch.network_module or ""
+        })
+    finally:
+        models.Session.remove()
+
+
+def test_conversion_statements_do_not_grow_with_equivalents(statements):
+    fewest, most = mapped_switches()
+    assert len(catalog.mapping_graph.neighbours(most.id)) > 10
+
+    # Loading the catalog is one query for the switches and one for the
+    # mapping, however many equivalents there are
+    assert cold_statements(statements, fewest) == 2
+    assert cold_statements(statements, most) == 2
+
+
+def test_warm_conversion_runs_no_statements(statements):
+    fewest, most = mapped_switches()
+    convert(most)
+
+    statements.count = 0
+    data = convert(most)
+    assert len(data["switches"]) > 10
+    assert statements.count == 0
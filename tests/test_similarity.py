@@ -0,0 +1,69 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import catalog
+from bot import ChatBot
+from similarity import damerau_levenshtein, similarity_index
+
+
+def listed_models(text):
+    return [line[2:] for line in text.split("\n") if line.startswith("- ")]
+
+
+def test_swapped_characters_are_one_edit():
+    assert damerau_levenshtein("ab", "ba") == 1
+    assert damerau_levenshtein("kitten", "sitting") == 3
+    # Gives up once the distance is sure to be over the limit
+    assert damerau_levenshtein("abcdef", "zzzzzz", 2) == 3
+
+
+def test_search_finds_exact_models():
+    assert similarity_index.search("C9300-48P-A") == [("C9300-48P-A", 1.0)]
+
+
+def test_search_suggests_the_closest_model_first():
+    for typo in ("C9300-48PA", "c9300 48p a"):
+        assert similarity_index.search(typo)[0][0] == "C9300-48P-A"
+    assert similarity_index.search("MS12O-8-HW")[0][0] == "MS120-8-HW"
+
+
+def test_search_ignores_unrelated_text():
+    assert similarity_index.search("zzzzzz") == []
+
+
+def test_rank_puts_the_closest_switches_first():
+    switches = [
+        switch for switch in catalog.switch_index.all()
+        if switch.model.startswith("C9500")
+    ]
+    ranked = similarity_index.rank("C9500-40X", switches)
+    assert ranked[0].model == "C9500-40X-A"
+    assert sorted(switches, key=lambda switch: switch.id) == sorted(
+        ranked, key=lambda switch: switch.id)
+
+
+def test_multiple_matches_are_listed_closest_first():
+    text = ChatBot().convert({"Model": "C9200L-24", "Network_Module": ""},
+                             "room")
+    models = listed_models(text)
+    assert len(models) > 1
+    # In catalog order the 24PXG models come before the 24T ones
+    assert models.index("C9200L-24T-4X-E") < models.index("C9200L-24PXG-2Y-A")
+    assert models == [
+        switch.model for switch in similarity_index.rank(
+            "C9200L-24", catalog.switch_index.find(model="C9200L-24"))
+    ]
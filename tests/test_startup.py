@@ -0,0 +1,61 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import json
+import subprocess
+import sys
+
+from conftest import ROOT_DIR
+
+# How long importing the app and calling create_app may take in a fresh
+# interpreter. Importing the Webex and Dialogflow libraries alone used to
+# take over a second.
+STARTUP_BUDGET_MS = 1000
+
+# Libraries that are only needed once a message comes in
+LAZY_MODULES = ["dialogflow", "webexteamssdk"]
+
+SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import app
+app.create_app(warm=False)
+print(json.dumps({
+    "ms": (time.perf_counter() - started) * 1000,
+    "loaded": [name for name in %r if name in sys.modules]
+}))
+""" % LAZY_MODULES
+
+
+def start():
+    # The token is made up, so anything that calls Webex at startup fails
+    output = subprocess.run([sys.executable, "-c", SCRIPT],
+                            cwd=ROOT_DIR,
+                            stdout=subprocess.PIPE,
+                            check=True,
+                            universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_startup_leaves_the_clients_alone():
+    assert start()["loaded"] == []
+
+
+def test_startup_is_within_budget():
+    # The median of a few starts, so one slow start doesn't fail the test
+    timings = sorted(start()["ms"] for i in range(3))
+    assert timings[1] < STARTUP_BUDGET_MS
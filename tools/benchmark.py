@@ -0,0 +1,637 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+# Usage:
+#   python tools/benchmark.py [--requests 200] [--webex-latency 0]
+#                             [--dialogflow-latency 0] [--concurrency 1]
+#                             [--save results.json] [--baseline results.json]
+#                             [--startup-budget 1000]
+#
+# Replays a mix of messages, /compare webhooks and card actions through the
+# Flask app against a throwaway SQLite copy of the catalog. Webex and
+# Dialogflow are replaced by local stand-ins so nothing leaves the machine.
+# Run it with --save to record a baseline and --baseline to compare a later
+# run against it. Startup is timed in a fresh interpreter, from importing the
+# app to create_app returning. The exit code is 1 if any scenario regressed
+# or startup took longer than --startup-budget.
+
+import argparse
+import atexit
+import datetime
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TOOLS_DIR))
+
+BOT_ID = "benchmark-bot"
+PERSON_ID = "benchmark"
+ROOM_ID = "benchmark-room"
+
+# Tokens that look like a model number, e.g. C9300-48P-A or MS120-8-HW
+MODEL_PATTERN = re.compile(r"\b[A-Za-z]+[0-9][A-Za-z0-9-]*\b")
+
+
+class Counters():
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = {"sql": 0, "webex": 0, "dialogflow": 0}
+
+    def add(self, name):
+        with self._lock:
+            self.values[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.values)
+
+
+counters = Counters()
+
+
+def create_database(path):
+    # The SQL scripts are written for MySQL, so translate the few bits
+    # SQLite doesn't understand. The indexes come from the migrations.
+    def to_sqlite(sql):
+        sql = re.sub(r"CREATE DATABASE[^;]*;", "", sql)
+        sql = re.sub(r"USE [^;]*;", "", sql)
+        sql = re.sub(r",\s*(UNIQUE )?INDEX \w+ \([^)]*\)", "", sql)
+        sql = sql.replace("AUTO_INCREMENT", "")
+        sql = sql.replace("INSERT IGNORE", "INSERT OR IGNORE")
+        return re.sub(r"\bVALUE\b", "VALUES", sql)
+
+    connection = sqlite3.connect(path)
+    for name in ["create_table.sql", "import_script.sql"]:
+        with open(os.path.join(TOOLS_DIR, name)) as f:
+            connection.executescript(to_sqlite(f.read()))
+    connection.execute("INSERT INTO users (id, privilege) VALUES (?, ?)",
+                       (PERSON_ID, "admin"))
+    connection.commit()
+    connection.close()
+
+
+class Stub(types.SimpleNamespace):
+    pass
+
+
+class FakeMessages():
+    def __init__(self, api):
+        self.api = api
+        self.store = {}
+        self._lock = threading.Lock()
+        self._count = 0
+
+    def post(self, text=None, files=None):
+        with self._lock:
+            self._count += 1
+            id = f"message-{self._count}"
+        self.store[id] = Stub(id=id,
+                              personId=PERSON_ID,
+                              roomId=ROOM_ID,
+                              text=text,
+                              files=files)
+        return id
+
+    def get(self, id):
+        self.api.call()
+        return self.store.pop(id)
+
+    def create(self, **kwargs):
+        self.api.call()
+        return Stub(id="sent", **kwargs)
+
+    def delete(self, messageId):
+        self.api.call()
+
+
+class FakeAttachmentActions():
+    def __init__(self, api):
+        self.api = api
+        self.store = {}
+
+    def get(self, id):
+        self.api.call()
+        return self.store.pop(id)
+
+
+class FakePeople():
+    def __init__(self, api):
+        self.api = api
+
+    def _person(self, id):
+        return Stub(id=id,
+                    type="bot" if id == BOT_ID else "person",
+                    displayName=id,
+                    emails=[f"{id}@cisco.com"])
+
+    def me(self):
+        self.api.call()
+        return self._person(BOT_ID)
+
+    def get(self, id):
+        self.api.call()
+        return self._person(id)
+
+    def list(self, id=None, email=None):
+        self.api.call()
+        return [self._person(id or email.split("@")[0])]
+
+
+class FakeWebexTeamsAPI():
+    latency = 0.0
+    instance = None
+
+    def __init__(self, *args, **kwargs):
+        FakeWebexTeamsAPI.instance = self
+        self.access_token = "benchmark"
+        self.messages = FakeMessages(self)
+        self.attachment_actions = FakeAttachmentActions(self)
+        self.people = FakePeople(self)
+        self.rooms = Stub(get=lambda id: Stub(id=id, title="Benchmark"))
+
+    def call(self):
+        counters.add("webex")
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class FakeSessionsClient():
+    latency = 0.0
+    client = None
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def session_path(self, project, session):
+        return f"projects/{project}/agent/sessions/{session}"
+
+    def detect_intent(self, session, query_input):
+        import dialogflow
+
+        counters.add("dialogflow")
+        if self.latency:
+            time.sleep(self.latency)
+
+        query_result = dialogflow.types.QueryResult(
+            query_text=query_input.text.text,
+            fulfillment_text="Sorry, I didn't get that.")
+        query_result.intent.display_name = "Default Fallback Intent"
+
+        # Pull out the model numbers like the trained agent would
+        tokens = MODEL_PATTERN.findall(query_input.text.text)
+        if tokens:
+            parameters = {"Model": tokens[0], "Network_Module": ""}
+            if len(tokens) > 1:
+                parameters["Network_Module"] = tokens[1]
+            query_result.intent.display_name = "Convert"
+            query_result.parameters.update(parameters)
+
+            # Dialogflow calls the fulfillment webhook before it replies
+            reply = self.client.post("/compare",
+                                     json={
+                                         "session": session,
+                                         "queryResult": {
+                                             "parameters": parameters
+                                         }
+                                     })
+            query_result.fulfillment_text = reply.get_json().get(
+                "fulfillmentText", "")
+
+        return dialogflow.types.DetectIntentResponse(query_result=query_result)
+
+
+def load_app(args):
+    directory = tempfile.mkdtemp(prefix="meercat-benchmark-")
+    atexit.register(shutil.rmtree, directory, True)
+    path = os.path.join(directory, "catalog.db")
+    create_database(path)
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ.setdefault("WEBEX_TEAMS_ACCESS_TOKEN", "benchmark")
+    os.environ.setdefault("DIALOGFLOW_PROJECT_ID", "benchmark")
+    # Every request comes from the same person and room
+    os.environ.setdefault("PERSON_RATE_LIMIT", "0")
+    os.environ.setdefault("ROOM_RATE_LIMIT", "0")
+
+    # Swap the clients out before the bot creates them
+    import dialogflow
+    import webexteamssdk
+
+    FakeWebexTeamsAPI.latency = args.webex_latency / 1000
+    FakeSessionsClient.latency = args.dialogflow_latency / 1000
+    webexteamssdk.WebexTeamsAPI = FakeWebexTeamsAPI
+    dialogflow.SessionsClient = FakeSessionsClient
+
+    import migrations
+    import models
+    from sqlalchemy import event
+
+    migrations.upgrade()
+
+    def count_statement(*args):
+        counters.add("sql")
+
+    models.on_engine_created(lambda engine: event.listen(
+        engine, "before_cursor_execute", count_statement))
+
+    import app
+
+    # Warm up in the foreground so it doesn't overlap the first scenario
+    application = app.create_app(warm=False)
+    started = time.perf_counter()
+    application.bot.warm()
+    warm = time.perf_counter() - started
+
+    FakeSessionsClient.client = application.test_client()
+    return application, warm
+
+
+def measure_startup(runs):
+    # Times importing the app and calling create_app in a fresh interpreter,
+    # as a new worker would, against the database load_app created. The real
+    # Webex and Dialogflow libraries are used, so anything that reaches for
+    # them at startup shows up here. Returns the median in milliseconds.
+    script = ("import time; started = time.perf_counter(); import app; "
+              "app.create_app(warm=False); "
+              "print((time.perf_counter() - started) * 1000)")
+    timings = []
+    for i in range(runs):
+        output = subprocess.run([sys.executable, "-c", script],
+                                cwd=os.path.dirname(TOOLS_DIR),
+                                env=os.environ.copy(),
+                                stdout=subprocess.PIPE,
+                                check=True,
+                                universal_newlines=True).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return percentile(sorted(timings), 50)
+
+
+class Scenarios():
+    def __init__(self, app, seed=0):
+        import catalog
+
+        self.app = app
+        self.client = app.test_client()
+        self.random = random.Random(seed)
+
+        switches = catalog.switch_index.all()
+        mapped = {
+            id.lower()
+            for edge in catalog.mapping_graph.edges() for id in edge
+        }
+        self.fixed = [
+            switch for switch in switches
+            if not switch.modular and switch.id.lower() in mapped
+        ]
+        self.modular = [
+            switch for switch in switches
+            if switch.modular and switch.id.lower() in mapped
+        ]
+        self.modular_models = sorted({switch.model for switch in self.modular})
+
+    def message(self, text):
+        api = FakeWebexTeamsAPI.instance
+        id = api.messages.post(text=text)
+        return self.client.post("/events",
+                                json={
+                                    "id": "webhook",
+                                    "resource": "messages",
+                                    "event": "created",
+                                    "data": {
+                                        "id": id,
+                                        "roomId": ROOM_ID,
+                                        "personId": PERSON_ID,
+                                    }
+                                })
+
+    def exact_hit(self):
+        switch = self.random.choice(self.fixed)
+        return self.message(switch.model)
+
+    def modular_hit(self):
+        switch = self.random.choice(self.modular)
+        return self.message(f"{switch.model} {switch.network_module}")
+
+    def modular_prompt(self):
+        return self.message(self.random.choice(self.modular_models))
+
+    def natural_language(self):
+        switch = self.random.choice(self.fixed)
+        return self.message(f"What is the equivalent of a {switch.model}?")
+
+    def fuzzy_hit(self):
+        # Leave the last part of the model off, e.g. C9200L-24T-4G
+        switch = self.random.choice(self.fixed)
+        model = switch.model.rsplit("-", 1)[0]
+        return self.message(f"convert {model.lower()} please")
+
+    def miss(self):
+        return self.message(
+            f"convert ZX{self.random.randint(1000, 9999)}-48P to meraki")
+
+    def compare(self):
+        switch = self.random.choice(self.fixed)
+        return self.client.post("/compare",
+                                json={
+                                    "session":
+                                    f"projects/benchmark/agent/sessions/{PERSON_ID}.{ROOM_ID}",
+                                    "queryResult": {
+                                        "parameters": {
+                                            "Model": switch.model,
+                                            "Network_Module": ""
+                                        }
+                                    }
+                                })
+
+    def info(self):
+        return self.message(f"/info {self.random.choice(self.fixed).id}")
+
+    def list_switches(self):
+        return self.message(
+            self.random.choice([
+                "/list switches", "/list switches C9300",
+                "/list switches page 2", "/list mapping", "/list mapping MS"
+            ]))
+
+    def edit(self):
+        import models
+
+        switch = self.random.choice(self.fixed)
+        # The edit card submits every field as text
+        inputs = {
+            field.name: str(field.format(getattr(switch, field.name)))
+            for field in models.SWITCH_FIELDS
+        }
+        inputs["note"] = f"Benchmark edit {self.random.randint(0, 999999)}"
+
+        api = FakeWebexTeamsAPI.instance
+        id = f"action-{self.random.randint(0, 10**9)}"
+        api.attachment_actions.store[id] = Stub(id=id,
+                                                personId=PERSON_ID,
+                                                roomId=ROOM_ID,
+                                                inputs=inputs)
+        return self.client.post("/actions",
+                                json={
+                                    "id": "webhook",
+                                    "resource": "attachmentActions",
+                                    "event": "created",
+                                    "data": {
+                                        "id": id,
+                                        "roomId": ROOM_ID,
+                                        "personId": PERSON_ID,
+                                        "messageId": "card",
+                                    }
+                                })
+
+    def all(self):
+        return {
+            "exact_hit": self.exact_hit,
+            "modular_hit": self.modular_hit,
+            "modular_prompt": self.modular_prompt,
+            "natural_language": self.natural_language,
+            "fuzzy_hit": self.fuzzy_hit,
+            "miss": self.miss,
+            "compare": self.compare,
+            "info": self.info,
+            "list": self.list_switches,
+            "edit": self.edit,
+        }
+
+
+def percentile(values, percent):
+    # Nearest rank on an already sorted list
+    if not values:
+        return 0.0
+    rank = max(1, int(round(percent / 100 * len(values))))
+    return values[min(rank, len(values)) - 1]
+
+
+def run_scenario(fn, requests, warmup, concurrency):
+    for i in range(warmup):
+        fn()
+
+    timings = []
+    errors = 0
+
+    def timed():
+        started = time.perf_counter()
+        try:
+            response = fn()
+            ok = response.status_code < 400
+        except Exception:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    before = counters.snapshot()
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(
+                executor.map(lambda i: timed(), range(requests)))
+    else:
+        results = [timed() for i in range(requests)]
+    elapsed = time.perf_counter() - started
+    after = counters.snapshot()
+
+    for duration, ok in results:
+        timings.append(duration * 1000)
+        if not ok:
+            errors += 1
+    timings.sort()
+
+    return {
+        "requests": requests,
+        "errors": errors,
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "p99_ms": round(percentile(timings, 99), 3),
+        "mean_ms": round(sum(timings) / len(timings), 3),
+        "max_ms": round(timings[-1], 3),
+        "throughput_rps": round(requests / elapsed, 1),
+        "sql_per_request": round((after["sql"] - before["sql"]) / requests,
+                                 2),
+        "webex_calls_per_request":
+        round((after["webex"] - before["webex"]) / requests, 2),
+        "dialogflow_calls_per_request":
+        round((after["dialogflow"] - before["dialogflow"]) / requests, 2),
+    }
+
+
+def compare_results(results, baseline, tolerance):
+    # Returns the scenarios that got slower by more than the tolerance
+    regressions = []
+    for name, result in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name, None)
+        if not before:
+            continue
+        checks = [
+            ("p95_ms", result["p95_ms"], before["p95_ms"], False),
+            ("throughput_rps", result["throughput_rps"],
+             before["throughput_rps"], True),
+            ("sql_per_request", result["sql_per_request"],
+             before["sql_per_request"], False),
+        ]
+        for metric, now, then, higher_is_better in checks:
+            if not then:
+                # There's no ratio to a baseline of 0, but a warm
+                # conversion that starts running SQL again has regressed
+                if metric == "sql_per_request" and now > 0:
+                    regressions.append(f"{name} {metric}: {then} -> {now}")
+                continue
+            change = (now - then) / then
+            if higher_is_better:
+                change = -change
+            if change > tolerance:
+                regressions.append(
+                    f"{name} {metric}: {then} -> {now} ({change:+.0%} worse)")
+    return regressions
+
+
+def print_results(results):
+    print(f"Startup: {results['startup_ms']} ms, warm up: {results['warm_ms']} ms\n")
+    header = f"{'scenario':<18}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>9}{'sql':>7}{'webex':>7}{'df':>6}{'err':>5}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results["scenarios"].items():
+        print(f"{name:<18}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}"
+              f"{r['p99_ms']:>9.2f}{r['throughput_rps']:>9.1f}"
+              f"{r['sql_per_request']:>7.2f}{r['webex_calls_per_request']:>7.2f}"
+              f"{r['dialogflow_calls_per_request']:>6.2f}{r['errors']:>5}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the bot against local stand-ins.")
+    parser.add_argument("--requests",
+                        type=int,
+                        default=200,
+                        help="Timed requests per scenario")
+    parser.add_argument("--warmup",
+                        type=int,
+                        default=10,
+                        help="Untimed requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--webex-latency",
+                        type=float,
+                        default=0,
+                        help="Milliseconds added to every Webex API call")
+    parser.add_argument("--dialogflow-latency",
+                        type=float,
+                        default=0,
+                        help="Milliseconds added to every Dialogflow call")
+    parser.add_argument("--scenario",
+                        action="append",
+                        help="Only run these scenarios")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--baseline",
+                        help="Compare against results saved with --save")
+    parser.add_argument("--tolerance",
+                        type=float,
+                        default=0.25,
+                        help="Allowed slowdown against the baseline")
+    parser.add_argument("--startup-budget",
+                        type=float,
+                        help="Milliseconds a cold start may take")
+    parser.add_argument("--startup-runs",
+                        type=int,
+                        default=3,
+                        help="Cold starts to take the median of")
+    args = parser.parse_args()
+
+    # The migrations and the bot print as they go, keep the report readable
+    stdout = sys.stdout
+    devnull = open(os.devnull, "w")
+    sys.stdout = devnull
+    try:
+        app, warm = load_app(args)
+    finally:
+        sys.stdout = stdout
+    startup = measure_startup(args.startup_runs)
+
+    scenarios = Scenarios(app, seed=args.seed).all()
+    if args.scenario:
+        scenarios = {
+            name: fn
+            for name, fn in scenarios.items() if name in args.scenario
+        }
+
+    results = {
+        "created_at": datetime.datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "settings": {
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "concurrency": args.concurrency,
+            "webex_latency_ms": args.webex_latency,
+            "dialogflow_latency_ms": args.dialogflow_latency,
+        },
+        "startup_ms": round(startup, 1),
+        "warm_ms": round(warm * 1000, 1),
+        "scenarios": {},
+    }
+    for name, fn in scenarios.items():
+        sys.stdout = devnull
+        try:
+            results["scenarios"][name] = run_scenario(
+                fn, args.requests, args.warmup, args.concurrency)
+        finally:
+            sys.stdout = stdout
+    devnull.close()
+
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {args.save}")
+
+    failed = False
+    if args.startup_budget is not None:
+        if results["startup_ms"] > args.startup_budget:
+            print(f"\nStartup took {results['startup_ms']} ms, over the "
+                  f"{args.startup_budget} ms budget.")
+            failed = True
+        else:
+            print(f"\nStartup is within the {args.startup_budget} ms budget.")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            for regression in regressions:
+                print(f"- {regression}")
+            failed = True
+        else:
+            print(f"\nNo regressions against {args.baseline}.")
+
+    if failed:
+        sys.exit(1)
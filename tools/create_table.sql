@@ -35,14 +35,20 @@ CREATE TABLE IF NOT EXISTS switch (
     mac_entry INTEGER,
     vlan INTEGER,
     note VARCHAR(255),
-    PRIMARY KEY (id)
+    PRIMARY KEY (id),
+    INDEX ix_switch_platform (platform),
+    INDEX ix_switch_model (model),
+    INDEX ix_switch_network_module (network_module)
 );
 
 CREATE TABLE IF NOT EXISTS mapping (
     id INTEGER NOT NULL AUTO_INCREMENT,
     catalyst VARCHAR(255) NOT NULL,
     meraki VARCHAR(255) NOT NULL,
-    PRIMARY KEY (id)
+    PRIMARY KEY (id),
+    INDEX ix_mapping_catalyst (catalyst),
+    INDEX ix_mapping_meraki (meraki),
+    UNIQUE INDEX uq_mapping_catalyst_meraki (catalyst, meraki)
 );
 
 CREATE TABLE IF NOT EXISTS users (
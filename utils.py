@@ -15,6 +15,10 @@ IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
 or implied.
 """
 
+import io
+from email.message import Message
+
+import requests
 from pyadaptivecards.actions import Submit
 from pyadaptivecards.card import AdaptiveCard
 from pyadaptivecards.components import (Column, Fact, Image, ImageSize,
@@ -23,6 +27,12 @@ from pyadaptivecards.container import Container, FactSet
 from pyadaptivecards.inputs import Choices, Number, Text, Toggle
 
 import models
+from cache import TTLCache
+
+_MISSING = object()
+
+# Webex rejects messages over 7439 bytes, leave some room to spare
+MESSAGE_SIZE_LIMIT = 7000
 
 
 def person_id_to_username(api, person_id):
@@ -36,6 +46,143 @@ def person_id_to_username(api, person_id):
     return None
 
 
+def attachment_details(response):
+    # Webex puts the original file name in the Content-Disposition header
+    headers = Message()
+    headers["Content-Disposition"] = response.headers.get(
+        "Content-Disposition", "")
+    filename = headers.get_param("filename", "", "Content-Disposition")
+
+    return filename, response.headers.get("Content-Type", "")
+
+
+def attachment_info(api, url):
+    # Looks up the name and type of an attached file without downloading it
+    response = requests.head(
+        url, headers={"Authorization": f"Bearer {api.access_token}"})
+    response.raise_for_status()
+
+    return attachment_details(response)
+
+
+def open_attachment(api, url):
+    # Streams a file attached to a Webex message rather than downloading it all
+    response = requests.get(
+        url,
+        headers={"Authorization": f"Bearer {api.access_token}"},
+        stream=True)
+    response.raise_for_status()
+
+    return (*attachment_details(response), response)
+
+
+def iter_text_lines(response):
+    # Wraps a streamed response so it can be read like a text file.
+    # urllib3 closes the stream as soon as the body has been read, which
+    # TextIOWrapper treats as an error at the end of the file.
+    response.raw.decode_content = True
+    response.raw.auto_close = False
+    return io.TextIOWrapper(response.raw, encoding="utf-8-sig", newline="")
+
+
+def fit_text(text, size):
+    # Cuts text down to at most size bytes without splitting a character
+    encoded = text.encode("utf-8")
+    if len(encoded) <= size:
+        return text
+    return encoded[:size].decode("utf-8", errors="ignore")
+
+
+def chunk_lines(lines, size):
+    # Groups lines into lists that are each at most size bytes once joined
+    chunk = []
+    chunk_size = 0
+    for line in lines:
+        line = fit_text(line, size - 1)
+        line_size = len(line.encode("utf-8")) + 1
+        if chunk and chunk_size + line_size > size:
+            yield chunk
+            chunk = []
+            chunk_size = 0
+        chunk.append(line)
+        chunk_size += line_size
+    if chunk:
+        yield chunk
+
+
+def paginate(title, lines, total, command, page=None, limit=MESSAGE_SIZE_LIMIT):
+    # Yields messages of lines that each fit under the Webex size limit, or
+    # just the requested page. Messages are built as they're sent so the
+    # whole list is never rendered at once.
+    def header(first, last):
+        return f"**{title} {first}-{last} of {total}:**\n\n"
+
+    def footer(number):
+        return f"\n\nSend `{command} page {number}` for more."
+
+    # Leave room for the largest header and footer a page can have
+    digits = "9" * len(str(total))
+    reserved = len(header(digits, digits).encode("utf-8")) + \
+        len(footer(digits).encode("utf-8"))
+
+    first = 1
+    number = 0
+    for chunk in chunk_lines(lines, limit - reserved):
+        number += 1
+        last = first + len(chunk) - 1
+        if page is None or page == number:
+            message = header(first, last) + "\n".join(chunk)
+            if page is not None and last < total:
+                message += footer(number + 1)
+            yield message.strip()
+            if page is not None:
+                return
+        first = last + 1
+
+    if page is not None:
+        yield f"There are only {number} page(s) of {title.lower()}."
+
+
+class WebexDirectory():
+    # Caches who people are and what rooms are so that each message doesn't
+    # cost extra round trips to Webex
+    def __init__(self, api, ttl=3600, maxsize=2048):
+        super().__init__()
+        self.api = api
+        self.people = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.emails = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.usernames = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.rooms = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get_person(self, person_id):
+        person = self.people.get(person_id, _MISSING)
+        if person is _MISSING:
+            person = self.api.people.get(person_id)
+            self.people.set(person_id, person)
+        return person
+
+    def get_username(self, person_id):
+        username = self.usernames.get(person_id, _MISSING)
+        if username is _MISSING:
+            username = person_id_to_username(self.api, person_id)
+            self.usernames.set(person_id, username)
+        return username
+
+    def find_people_by_email(self, email):
+        people = self.emails.get(email, _MISSING)
+        if people is _MISSING:
+            people = list(self.api.people.list(email=email))
+            self.emails.set(email, people)
+        return people
+
+    def get_room(self, room_id):
+        room = self.rooms.get(room_id, _MISSING)
+        if room is _MISSING:
+            room = self.api.rooms.get(room_id)
+            self.rooms.set(room_id, room)
+        return room
+
+
 class DictWrapper:
     def __init__(self, d):
         self.__d = d
@@ -70,10 +217,11 @@ class Responses:
         title = Container(items=items)
 
         facts = []
-        for attr, description in models.Switch._name_mapping.items():
-            value = vars(switch_data).get(attr, None)
+        values = vars(switch_data)
+        for field in models.SWITCH_FIELDS:
+            value = values.get(field.name, None)
             if value:
-                facts.append(Fact(description, value))
+                facts.append(Fact(field.pretty_name, value))
 
         factset = FactSet(facts)
 
@@ -88,22 +236,62 @@ class Responses:
         return attachment
 
     @staticmethod
-    def generate_switches_response(switches):
-        response = f"**The following {len(switches)} switches are in the database:**\n\n"
-
-        for switch in switches:
-            response += f"- {switch.id}  \n"
+    def generate_switches_response(switches,
+                                   page=None,
+                                   command="/list switches"):
+        if not switches:
+            return "**There are no switches in the database.**"
 
-        return response.strip()
+        lines = (f"- {switch.id}  " for switch in switches)
+        return paginate("Switches", lines, len(switches), command, page=page)
 
     @staticmethod
-    def generate_mapping_response(mappings):
-        response = f"**The following {len(mappings)} mappings are in the database:**\n\n"
+    def generate_mapping_response(mappings, page=None, command="/list mapping"):
+        if not mappings:
+            return "**There are no mappings in the database.**"
 
-        for mapping in mappings:
-            response += f"- {mapping.catalyst} <=> {mapping.meraki}  \n"
+        lines = (f"- {mapping.catalyst} <=> {mapping.meraki}  "
+                 for mapping in mappings)
+        return paginate("Mappings", lines, len(mappings), command, page=page)
 
-        return response.strip()
+    @staticmethod
+    def generate_batch_response(batch, limit=5):
+        # A summary, then a line per SKU split into messages that fit
+        def shorten(ids):
+            text = ", ".join(ids[:limit])
+            if len(ids) > limit:
+                text += f" and {len(ids) - limit} more"
+            return text
+
+        def describe(result):
+            sku = " ".join(value for value in (result["model"],
+                                               result["network_module"])
+                           if value)
+            status = result["status"]
+            line = f"- {sku or '(blank)'}: **{status}**"
+            if status == "matched":
+                line += f" => {shorten(result['equivalents'])}"
+            elif status in ("ambiguous", "modular-needs-module"):
+                line += f", could be {shorten(result['candidates'])}"
+            elif status == "unmapped" and result["nearest"]:
+                nearest = result["nearest"][0]
+                line += f", closest is {nearest['id']} ({nearest['confidence']:.0%} match)"
+            return line + "  "
+
+        results = batch["results"]
+        if not results:
+            return "Please list the models to convert, one per line or separated by commas."
+
+        def messages():
+            counts = ", ".join(f"{count} {status}"
+                               for status, count in batch["summary"].items()
+                               if count)
+            yield f"**Converted {len(results)} models:** {counts}."
+            yield from paginate("Conversions",
+                                (describe(result) for result in results),
+                                len(results), "/convert")
+
+        return messages()
 
     @staticmethod
     def generate_edit_response(switch):
@@ -118,21 +306,21 @@ class Responses:
         ])
 
         items = []
-        vars(models.Switch).keys()
-        for attr, description in models.Switch._name_mapping.items():
-            try:
-                value = vars(switch).get(attr, None)
-                # Don't append null values or internal attributes
-                if attr[0] != '_':
-                    if type(value) == bool:
-                        items.append(Toggle(description, attr, value=value))
-                    else:
-                        items.append(TextBlock(text=f"{description}"))
-                        items.append(
-                            Text(attr, placeholder=f"{description}", value=value))
-
-            except AttributeError:
-                continue
+        values = vars(switch)
+        for field in models.SWITCH_FIELDS:
+            value = values.get(field.name, None)
+            if field.type == bool:
+                # Toggles take the same strings they submit
+                items.append(
+                    Toggle(field.pretty_name,
+                           field.name,
+                           value=field.format(bool(value))))
+            else:
+                items.append(TextBlock(text=f"{field.pretty_name}"))
+                items.append(
+                    Text(field.name,
+                         placeholder=f"{field.pretty_name}",
+                         value=value))
 
         submit = Submit(title="Update")
 
@@ -160,17 +348,15 @@ class Responses:
         ])
 
         items = []
-        for attr in vars(models.Switch).keys():
-            # Don't append null values or internal attributes
-            if attr[0] != '_':
-                # This is so stupid, probably not the best way to do it
-                target_type = str(
-                    getattr(models.Switch, attr).property.columns[0].type)
-                if target_type == "BOOLEAN":
-                    items.append(Toggle(attr, attr))
-                else:
-                    items.append(TextBlock(text=f"{attr}"))
-                    items.append(Text(attr, placeholder=f"{attr}"))
+        for field in models.SWITCH_FIELDS:
+            if field.type == bool:
+                items.append(Toggle(field.pretty_name, field.name))
+            else:
+                label = field.pretty_name
+                if not field.nullable:
+                    label += " (required)"
+                items.append(TextBlock(text=f"{label}"))
+                items.append(Text(field.name, placeholder=f"{field.pretty_name}"))
 
         submit = Submit(title="Add")
 
@@ -190,10 +376,17 @@ class Responses:
         return attachment
 
     @staticmethod
-    def generate_user_access_request(api, editor, person_id, username,
-                                     parameters):
+    def generate_user_access_request(api,
+                                     editor,
+                                     person_id,
+                                     username,
+                                     parameters,
+                                     directory=None):
         admins = editor.get_admin_users()
-        person = api.people.get(person_id)
+        if directory:
+            person = directory.get_person(person_id)
+        else:
+            person = api.people.get(person_id)
         if not person or not admins:
             pass
 
@@ -208,10 +401,14 @@ class Responses:
                                 markdown=message)
 
     @staticmethod
-    def generate_approved_users_response(api, users):
+    def generate_approved_users_response(api, users, directory=None):
         message = "**Users with editing permissions:**\n\n"
         for user in users:
-            persons = api.people.list(email=f"{user.id}@cisco.com")
+            if directory:
+                persons = directory.find_people_by_email(
+                    f"{user.id}@cisco.com")
+            else:
+                persons = api.people.list(email=f"{user.id}@cisco.com")
             for person in persons:
                 message += f"{person.displayName} => {user.id}  \n"
         return message
@@ -0,0 +1,110 @@
+"""
+Copyright (c) 2020 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+# Tells a worker thread to exit once everything queued before it is done
+_STOP = object()
+
+
+class WorkerPool():
+    def __init__(self, workers=4, max_queue=100):
+        super().__init__()
+        self.workers = workers
+        self.max_queue = max_queue
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._accepting = False
+        self._lock = threading.Lock()
+
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run,
+                                          name=f"webhook-worker-{i}",
+                                          daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._accepting = True
+
+    def submit(self, fn, *args):
+        # Returns False if the job could not be queued
+        if not self._accepting:
+            self.rejected += 1
+            return False
+        try:
+            self._queue.put_nowait((fn, args))
+            return True
+        except queue.Full:
+            self.rejected += 1
+            return False
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is _STOP:
+                    return
+                fn, args = job
+                fn(*args)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                logging.exception("Webhook worker failed to process a job")
+            finally:
+                self._queue.task_done()
+
+    def shutdown(self, timeout=30):
+        # Stop taking new work and let the queued jobs drain
+        with self._lock:
+            if not self._accepting:
+                return
+            self._accepting = False
+
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            try:
+                self._queue.put(_STOP,
+                                timeout=max(0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+        if any(thread.is_alive() for thread in self._threads):
+            logging.warning(
+                f"Webhook workers did not drain within {timeout} seconds, "
+                f"{self._queue.qsize()} jobs abandoned")
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize(),
+            "max_queue": self.max_queue,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }